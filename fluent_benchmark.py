@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+"""Micro benchmarks for fluentpy.
+
+Every benchmark times a piece of fluent code against a baseline, usually the
+equivalent plain python, so you can see what the wrapper costs.
+
+    $ python3 fluent_benchmark.py          # run all benchmarks
+    $ python3 fluent_benchmark.py wrap     # only those whose name contains 'wrap'
+    $ python3 fluent_benchmark.py --import-time  # check the import time against IMPORT_TIME_BUDGET
+
+Results can be stored as json and compared with a later run. The comparison is done on the
+factor between fluent and baseline, so results from different machines stay roughly comparable.
+It exits with status 1 if any factor grew by more than the threshold.
+
+    $ python3 fluent_benchmark.py --json before.json
+    $ python3 fluent_benchmark.py --compare before.json --threshold 0.1 --threshold cli=0.5
+
+If pyperf is installed, it can run the benchmarks instead, which is slower but more precise:
+
+    $ python3 fluent_benchmark.py --pyperf --filter iterable -o after.json
+    $ python3 -m pyperf compare_to before.json after.json
+"""
+
+import argparse
+import collections.abc
+import functools
+import itertools
+import json
+import math
+import operator
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import timeit
+import types
+import typing
+
+import fluentpy as _
+
+benchmarks = []
+
+# Cumulative import time of fluentpy in seconds, as reported by `python -X importtime`.
+# Shell filters start python over and over, so this should stay well below the startup of python itself.
+IMPORT_TIME_BUDGET = 0.010
+
+# How much the fluent/baseline factor of a benchmark may grow against an earlier run before it counts as a regression.
+# Micro benchmarks are noisy, so this is generous. Use --threshold to tighten or loosen it.
+DEFAULT_THRESHOLD = 0.25
+
+def benchmark(function):
+    """Register a benchmark.
+
+    Benchmarks are functions that return an iterable of (name, fluent, baseline) tuples,
+    where fluent and baseline are callables without arguments that should be timed.
+    """
+    benchmarks.append(function)
+    return function
+
+def time_per_call(function, repeat=5):
+    "Best time of `repeat` runs in seconds per call"
+    timer = timeit.Timer(function)
+    number, _ignored = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def cases(name_filter=''):
+    "All (name, fluent, baseline) tuples whose name contains `name_filter`"
+    for a_benchmark in benchmarks:
+        for name, fluent, baseline in a_benchmark():
+            name = '%s: %s' % (a_benchmark.__name__, name)
+            if name_filter in name:
+                yield name, fluent, baseline
+
+def measure(name_filter='', repeat=5):
+    "Time the benchmarks, returns {name: dict(fluent=seconds, baseline=seconds)} in seconds per call"
+    results = {}
+    for name, fluent, baseline in cases(name_filter):
+        results[name] = dict(fluent=time_per_call(fluent, repeat), baseline=time_per_call(baseline, repeat))
+    return results
+
+def factor(result):
+    "How many times slower fluent is than the baseline, which is mostly independent of the machine"
+    return result['fluent'] / result['baseline']
+
+def threshold_for(name, thresholds):
+    """Allowed relative growth of the factor of the benchmark `name`.
+    
+    `thresholds` maps name filters to thresholds, the longest filter contained in `name` wins
+    and the filter '' is the default.
+    """
+    matching = max((name_filter for name_filter in thresholds if name_filter in name), key=len)
+    return thresholds[matching]
+
+def regressions(results, previous_results, thresholds):
+    "Names of the benchmarks whose factor grew by more than their threshold since `previous_results`"
+    return [
+        name for name, result in results.items()
+        if name in previous_results
+        and factor(result) > factor(previous_results[name]) * (1 + threshold_for(name, thresholds))
+    ]
+
+def report(results, previous_results=None, thresholds=None):
+    "Print the results as a table, compared to `previous_results` if given"
+    previous_results = previous_results or {}
+    slower = regressions(results, previous_results, thresholds or {'': 0})
+    print('%-50s %12s %12s %8s %9s' % ('benchmark', 'fluent', 'baseline', 'factor', 'previous'))
+    for name, result in results.items():
+        comparison = ''
+        if name in previous_results:
+            comparison = '%7.2fx%s' % (factor(previous_results[name]), ' SLOWER' if name in slower else '')
+        print('%-50s %10.0fns %10.0fns %7.2fx %s' % (
+            name, result['fluent'] * 1e9, result['baseline'] * 1e9, factor(result), comparison))
+    return slower
+
+def save(results, path):
+    "Store results as json, together with what they were measured on"
+    with open(path, 'w') as file:
+        json.dump(dict(
+            python=platform.python_version(),
+            implementation=platform.python_implementation(),
+            machine=platform.machine(),
+            benchmarks=results,
+        ), file, indent=2)
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)['benchmarks']
+
+def run(name_filter='', repeat=5, json_path=None, compare_path=None, thresholds=None):
+    """Run, print and optionally store and compare the benchmarks. 
+    
+    Returns the names of the benchmarks that regressed against the results in `compare_path`.
+    """
+    results = measure(name_filter, repeat)
+    previous_results = load(compare_path) if compare_path else None
+    slower = report(results, previous_results, thresholds)
+    if json_path:
+        save(results, json_path)
+    return slower
+
+def run_pyperf(argv):
+    """Run every fluent and baseline callable as its own pyperf benchmark.
+    
+    pyperf runs them in calibrated worker processes, can store its own json with `-o` and
+    compare those with `python3 -m pyperf compare_to`.
+    """
+    import pyperf
+    def pass_to_workers(command, arguments):
+        command.extend(['--pyperf', '--filter', arguments.filter])
+    runner = pyperf.Runner(add_cmdline_args=pass_to_workers)
+    runner.argparser.add_argument('--pyperf', action='store_true')
+    runner.argparser.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    arguments = runner.parse_args(argv)
+    for name, fluent, baseline in cases(arguments.filter):
+        runner.bench_func(name + ' (fluent)', fluent)
+        runner.bench_func(name + ' (baseline)', baseline)
+
+def parse_threshold(argument):
+    "'0.2' is the default threshold, 'cli=1.0' the threshold for all benchmarks whose name contains 'cli'"
+    name_filter, _separator, threshold = argument.rpartition('=')
+    return name_filter, float(threshold)
+
+def main(argv):
+    if '--pyperf' in argv:
+        return run_pyperf(argv[1:])
+    
+    parser = argparse.ArgumentParser(description='Micro benchmarks for fluentpy, see the module docstring.')
+    parser.add_argument('filter', nargs='?', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5, help='take the best of this many timings')
+    parser.add_argument('--json', metavar='PATH', help='store the results as json')
+    parser.add_argument('--compare', metavar='PATH', help='compare with the results stored with --json in an earlier run')
+    parser.add_argument('--threshold', metavar='[FILTER=]FRACTION', type=parse_threshold, action='append', default=[],
+        help='allowed growth of the fluent/baseline factor against --compare, default %s' % DEFAULT_THRESHOLD)
+    parser.add_argument('--import-time', action='store_true', help='check the import time against IMPORT_TIME_BUDGET')
+    arguments = parser.parse_args(argv[1:])
+    
+    if arguments.import_time:
+        return 0 if check_import_time() else 1
+    
+    thresholds = dict([('', DEFAULT_THRESHOLD)] + arguments.threshold)
+    slower = run(arguments.filter, arguments.repeat, arguments.json, arguments.compare, thresholds)
+    return 1 if slower else 0
+
+def uncached_wrap(wrapped, *, previous=None, chain=None):
+    "wrap() as it was before the type dispatch cache"
+    if isinstance(wrapped, _.Wrapper):
+        return wrapped
+
+    by_type = (
+        (types.ModuleType, _.Module),
+        (typing.Text, _.Text),
+        (typing.Mapping, _.Mapping),
+        (typing.AbstractSet, _.Set),
+        (typing.Iterable, _.Iterable),
+        (typing.Callable, _.Callable),
+    )
+
+    if wrapped is None and chain is None and previous is not None:
+        chain = previous.self.unwrap
+
+    decider = wrapped
+    if wrapped is None and chain is not None:
+        decider = chain
+
+    for clazz, wrapper in by_type:
+        if isinstance(decider, clazz):
+            return wrapper(wrapped, previous=previous, chain=chain)
+
+    return _.Wrapper(wrapped, previous=previous, chain=chain)
+
+@benchmark
+def wrap_dispatch():
+    "Cached wrap() against the linear isinstance scan it replaced"
+    def function(): pass
+    for name, value in (
+        ('str', 'foo'),
+        ('list', [1, 2, 3]),
+        ('dict', dict(foo='bar')),
+        ('set', {1, 2, 3}),
+        ('function', function),
+        ('object', object()),
+    ):
+        yield name, lambda value=value: _(value), lambda value=value: uncached_wrap(value)
+
+@benchmark
+def attribute_access():
+    "Attribute and item access through an existing wrapper against the plain access"
+    item = Item(3, 2)
+    record = dict(price=3, quantity=2)
+    numbers = [1, 2, 3]
+    wrapped_item, wrapped_record, wrapped_numbers = _(item), _(record), _(numbers)
+    yield 'Wrapper.__getattr__', lambda: wrapped_item.price, lambda: item.price
+    yield 'Wrapper.__getitem__ dict', lambda: wrapped_record['price'], lambda: record['price']
+    yield 'Wrapper.__getitem__ list', lambda: wrapped_numbers[1], lambda: numbers[1]
+    yield 'method of wrapped value', lambda: wrapped_record.keys(), lambda: record.keys()
+
+class Item(object):
+    def __init__(self, price, quantity):
+        self.price, self.quantity = price, quantity
+
+@benchmark
+def each_expressions():
+    "Compiled each expressions against the equivalent hand written lambda"
+    numbers = list(range(1000))
+    items = [Item(index, 2) for index in range(1000)]
+    records = [dict(price=index, quantity=2) for index in range(1000)]
+    for name, expression, function, data in (
+        ('each + 3', _.each + 3, lambda each: each + 3, numbers),
+        ('(each + 3) * 2', (_.each + 3) * 2, lambda each: (each + 3) * 2, numbers),
+        ('each.price * each.quantity + 1', _.each.price * _.each.quantity + 1,
+            lambda each: each.price * each.quantity + 1, items),
+        ("each['price'] * each['quantity']", _.each['price'] * _.each['quantity'],
+            lambda each: each['price'] * each['quantity'], records),
+        ('each.price on dicts', _.each.price, operator.itemgetter('price'), records),
+        ('each.price on objects', _.each.price, operator.attrgetter('price'), items),
+        ("each['price', 'quantity']", _.each['price', 'quantity'], operator.itemgetter('price', 'quantity'), records),
+        ("each.pick('price', 'quantity')", _.each.pick('price', 'quantity'),
+            operator.attrgetter('price', 'quantity'), items),
+        ('each.call.bit_length()', _.each.call.bit_length(), lambda each: each.bit_length(), numbers),
+    ):
+        yield name, \
+            lambda expression=expression, data=data: _(data).map(expression), \
+            lambda function=function, data=data: _(data).map(function)
+
+@benchmark
+def curry():
+    "Calling curried functions against the equivalent lambda"
+    numbers = list(range(1000))
+    for name, curried, function, arguments in (
+        ('curry(_, 3)', _(operator.add).curry(_, 3, unwrap=True), lambda each: operator.add(each, 3), (numbers,)),
+        ('curry(_._1, _._0)', _(operator.sub).curry(_._1, _._0, unwrap=True),
+            lambda first, second: operator.sub(second, first), (numbers, numbers)),
+        ('curry(1, _._args)', _(max).curry(1, _._args, unwrap=True), lambda *args: max(1, *args), (numbers, numbers)),
+    ):
+        yield name, \
+            lambda curried=curried, arguments=arguments: list(map(curried, *arguments)), \
+            lambda function=function, arguments=arguments: list(map(function, *arguments))
+
+@benchmark
+def callables():
+    "Calling, currying and composing wrapped functions against plain calls and lambdas"
+    def add(first, second): return first + second
+    def double(number): return number * 2
+    wrapped_add = _(add)
+    curried = wrapped_add.curry(_, 3)
+    composed = _(double).compose(double)
+    yield 'Callable.__call__', lambda: wrapped_add(1, 2), lambda: add(1, 2)
+    yield 'Callable.curry()', lambda: wrapped_add.curry(_, 3), lambda: (lambda each: add(each, 3))
+    yield 'calling curried', lambda: curried(1), lambda: add(1, 3)
+    yield 'Callable.compose()', lambda: _(double).compose(double), lambda: (lambda each: double(double(each)))
+    yield 'calling composed', lambda: composed(1), lambda: double(double(1))
+
+def iterable_methods():
+    """(name, data, fluent method call, plain python) for the eager methods of Iterable.
+    
+    pmap(), pstar_map() and pfilter() are left out, starting their process pool dwarfs the rest.
+    The fluent side is a function of the wrapped data, the plain side of the data itself.
+    """
+    numbers = list(range(100))
+    pairs = list(zip(numbers, numbers))
+    nested = [[index, [index]] for index in numbers]
+    lines = ['line %i' % index for index in numbers]
+    return (
+        ('tuplify', numbers, lambda wrapped: wrapped.tuplify(), tuple),
+        ('listify', numbers, lambda wrapped: wrapped.listify(), list),
+        ('dictify', pairs, lambda wrapped: wrapped.dictify(), dict),
+        ('setify', numbers, lambda wrapped: wrapped.setify(), set),
+        ('len', numbers, lambda wrapped: wrapped.len(), len),
+        ('max', numbers, lambda wrapped: wrapped.max(), max),
+        ('min', numbers, lambda wrapped: wrapped.min(), min),
+        ('sum', numbers, lambda wrapped: wrapped.sum(), sum),
+        ('any', numbers, lambda wrapped: wrapped.any(), any),
+        ('all', numbers, lambda wrapped: wrapped.all(), all),
+        ('reduce', numbers, lambda wrapped: wrapped.reduce(operator.add), lambda data: functools.reduce(operator.add, data)),
+        ('join', numbers, lambda wrapped: wrapped.join(','), lambda data: ','.join(map(str, data))),
+        ('get', numbers, lambda wrapped: wrapped.get(5), lambda data: data[5]),
+        ('star_call', numbers, lambda wrapped: wrapped.star_call(max), lambda data: max(*data)),
+        ('map', numbers, lambda wrapped: wrapped.map(str), lambda data: tuple(map(str, data))),
+        ('star_map', pairs, lambda wrapped: wrapped.star_map(operator.add),
+            lambda data: tuple(itertools.starmap(operator.add, data))),
+        ('filter', numbers, lambda wrapped: wrapped.filter(bool), lambda data: tuple(filter(bool, data))),
+        ('enumerate', numbers, lambda wrapped: wrapped.enumerate(), lambda data: tuple(enumerate(data))),
+        ('reversed', numbers, lambda wrapped: wrapped.reversed(), lambda data: tuple(reversed(data))),
+        ('sorted', numbers, lambda wrapped: wrapped.sorted(), lambda data: tuple(sorted(data))),
+        ('grouped', numbers, lambda wrapped: wrapped.grouped(2), lambda data: tuple(zip(*[iter(data)] * 2))),
+        ('zip', numbers, lambda wrapped: wrapped.zip(numbers), lambda data: tuple(zip(data, numbers))),
+        ('flatten', nested, lambda wrapped: wrapped.flatten(), lambda data: tuple(
+            leaf for first, rest in data for leaf in (first, *rest))),
+        ('groupby', numbers, lambda wrapped: wrapped.groupby(_.each // 10), lambda data: tuple(
+            (key, tuple(values)) for key, values in itertools.groupby(data, lambda each: each // 10))),
+        ('cycle', numbers, lambda wrapped: _(itertools.islice(wrapped.icycle(), 200)).tuplify(),
+            lambda data: tuple(itertools.islice(itertools.cycle(data), 200))),
+        ('accumulate', numbers, lambda wrapped: wrapped.accumulate(operator.add),
+            lambda data: tuple(itertools.accumulate(data, operator.add))),
+        ('dropwhile', numbers, lambda wrapped: wrapped.dropwhile(_.each < 50),
+            lambda data: tuple(itertools.dropwhile(lambda each: each < 50, data))),
+        ('filterfalse', numbers, lambda wrapped: wrapped.filterfalse(bool),
+            lambda data: tuple(itertools.filterfalse(bool, data))),
+        ('grep', lines, lambda wrapped: wrapped.grep(r'1$'), lambda data: tuple(
+            line for line in data if re.search(r'1$', line))),
+        ('sub', lines, lambda wrapped: wrapped.sub(r'line', 'row'), lambda data: tuple(
+            re.sub(r'line', 'row', line) for line in data)),
+    )
+
+# methods of Iterable that lazy() records as a step instead of running them
+LAZY_STEPS = ('map', 'star_map', 'filter', 'enumerate', 'zip', 'grouped', 'flatten',
+    'accumulate', 'dropwhile', 'filterfalse', 'grep', 'sub')
+
+@benchmark
+def iterable_eager():
+    "Eager methods of Iterable on 100 elements against the equivalent builtins and itertools"
+    for name, data, method, baseline in iterable_methods():
+        yield name, \
+            lambda data=data, method=method: method(_(data)), \
+            lambda data=data, baseline=baseline: baseline(data)
+
+@benchmark
+def iterable_lazy():
+    "The same methods recorded as steps of lazy() and run by collect(), against the builtins"
+    for name, data, method, baseline in iterable_methods():
+        if name not in LAZY_STEPS:
+            continue
+        yield name, \
+            lambda data=data, method=method: method(_(data).lazy()).collect(), \
+            lambda data=data, baseline=baseline: baseline(data)
+    numbers = list(range(100))
+    yield 'map.filter.sum pipeline', \
+        lambda: _(numbers).lazy().map(_.each * 2).filter(_.each > 4).sum(), \
+        lambda: sum(each for each in (each * 2 for each in numbers) if each > 4)
+
+@benchmark
+def group_by():
+    "Hash based group_by() against a dict loop and against sorting for groupby()"
+    records = [(index % 100, index) for index in range(10000)]
+    def summed(records):
+        sums = {}
+        for key, value in records:
+            sums[key] = sums.get(key, 0) + value
+        return tuple(sums.items())
+    yield 'group_by sum vs dict loop', \
+        lambda: _(records).group_by(_.each[0], 'sum', value=_.each[1]), \
+        lambda: summed(records)
+    yield 'group_by sum vs sorted groupby', \
+        lambda: _(records).group_by(_.each[0], 'sum', value=_.each[1]), \
+        lambda: _(records).sorted(key=_.each[0]).groupby(_.each[0]).map(
+            lambda group: (group[0], sum(value for key, value in group[1])))
+    yield 'group_by collect vs sorted groupby', \
+        lambda: _(records).group_by(_.each[0]), \
+        lambda: _(records).sorted(key=_.each[0]).groupby(_.each[0])
+
+@benchmark
+def fork():
+    "Feeding one iterator to several consumers with fork() against materializing it in a list first"
+    def run_all(numbers):
+        numbers = list(numbers)
+        return len(numbers), sum(numbers), max(numbers)
+    yield 'fork(count, sum, max)', \
+        lambda: _(iter(range(100000))).fork(lambda each: sum(1 for element in each), sum, max), \
+        lambda: run_all(iter(range(100000)))
+
+@benchmark
+def sorting():
+    "Sorting in runs and the heap based top k against sorting everything with the builtin sorted"
+    import random
+    numbers = [random.random() for index in range(100000)]
+    yield 'sorted(run_size=10000)', lambda: _(numbers).sorted(run_size=10000), lambda: tuple(sorted(numbers))
+    yield 'nlargest(100)', lambda: _(numbers).nlargest(100), lambda: tuple(sorted(numbers, reverse=True)[:100])
+
+@benchmark
+def unique():
+    "Deduplicating with a set and with a bloom filter against a hand written loop"
+    import random
+    numbers = [random.randrange(50000) for index in range(100000)]
+    def by_hand():
+        seen = set()
+        return tuple(seen.add(number) or number for number in numbers if number not in seen)
+    yield 'unique()', lambda: _(numbers).unique(), by_hand
+    yield 'unique(approx=True)', lambda: _(numbers).unique(approx=True, capacity=50000), by_hand
+
+@benchmark
+def sketches():
+    "Fixed memory sketches against the exact set, Counter and sorted they replace"
+    import random
+    numbers = [int(random.paretovariate(1.2)) for index in range(100000)]
+    yield 'approx_distinct()', lambda: _(numbers).approx_distinct(), lambda: len(set(numbers))
+    yield 'heavy_hitters(100)', lambda: _(numbers).heavy_hitters(100).most_common(10), lambda: collections.Counter(numbers).most_common(10)
+    yield 'approx_quantiles()', lambda: _(numbers).approx_quantiles().quantiles(0.5, 0.99), lambda: sorted(numbers)[len(numbers) // 2]
+
+@benchmark
+def joins():
+    "Hash and merge joins against building the dict by hand"
+    orders = [(index, index % 1000) for index in range(10000)]
+    customers = [(index, 'customer %i' % index) for index in range(1000)]
+    def by_hand():
+        index = {}
+        for customer in customers:
+            index.setdefault(customer[0], []).append(customer)
+        return tuple((order, customer) for order in orders for customer in index.get(order[1], ()))
+    sorted_orders = sorted(orders, key=operator.itemgetter(1))
+    yield 'join_on', lambda: _(orders).join_on(customers, _.each[1], _.each[0]), by_hand
+    yield 'merge_join', lambda: _(sorted_orders).merge_join(customers, _.each[1], _.each[0]), by_hand
+
+def recursive_iflatten(iterable, level=math.inf):
+    "Iterable.iflatten() as it was before it used a stack, with a wrapper and a generator per nested iterable"
+    for element in iterable:
+        if level > 0 and isinstance(element, collections.abc.Iterable):
+            yield from recursive_iflatten(_(element), level - 1)
+        else:
+            yield element
+
+@benchmark
+def flatten():
+    "The stack based flatten() against the recursive one it replaced"
+    wide = [[index, [index, index]] for index in range(1000)]
+    deep = [0]
+    for index in range(1, 500): # stays below the recursion limit for the recursive version
+        deep = [deep, index]
+    for name, data in (('wide', wide), ('deep', deep)):
+        yield name, \
+            lambda data=data: _(data).flatten(), \
+            lambda data=data: tuple(recursive_iflatten(data))
+
+@benchmark
+def regex():
+    "Regex methods with more distinct patterns than the cache in re holds, against the functions from re"
+    patterns = [r'item%i\b' % index for index in range(2000)]
+    line = 'some log line mentioning item1999 somewhere'
+    lines = [line] * 1000
+    yield '2000 patterns with Text.search', \
+        lambda: [_(line).search(pattern) for pattern in patterns], \
+        lambda: [re.search(pattern, line) for pattern in patterns]
+    for method, arguments in (
+        ('search', (r'item\d+', line)),
+        ('match', (r'some', line)),
+        ('fullmatch', (r'.*', line)),
+        ('split', (r'\s+', line)),
+        ('findall', (r'[a-z]+', line)),
+        ('sub', (r'item', 'entry', line)),
+        ('subn', (r'item', 'entry', line)),
+    ):
+        yield 'Text.%s' % method, \
+            lambda method=method, arguments=arguments: getattr(_(line), method)(*arguments[:-1]), \
+            lambda method=method, arguments=arguments: getattr(re, method)(*arguments)
+    yield 'Iterable.grep', \
+        lambda: _(lines).grep(r'item\d+'), \
+        lambda: tuple(line for line in lines if re.search(r'item\d+', line))
+
+@benchmark
+def module_attributes():
+    "Attribute access through lib against the plain attribute access"
+    yield 'lib.os.path.join', lambda: _.lib.os.path.join, lambda: os.path.join
+    yield 'lazy_lib.os.path.join', lambda: _.lazy_lib.os.path.join, lambda: os.path.join
+    yield 'lib.json (import)', lambda: _.lib.json, lambda: __import__('json')
+
+@benchmark
+def cli():
+    "Shell filters with the fluentpy command line against the same filter with python -c"
+    lines = ''.join('line %i\n' % index for index in range(1000)).encode()
+    fluentpy = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fluentpy.py')
+    def shell(*arguments):
+        return lambda: subprocess.run((sys.executable,) + arguments, input=lines, stdout=subprocess.DEVNULL,
+            env=python_environment(), check=True)
+    yield 'startup', shell(fluentpy, 'pass'), shell('-c', 'pass')
+    yield '-p line.upper()', shell(fluentpy, '-p', 'line.upper()'), shell('-c',
+        'import sys\nfor line in sys.stdin: sys.stdout.write(line.upper())')
+    yield '-n print(line.upper())', shell(fluentpy, '-n', 'print(line.upper())'), shell('-c',
+        'import sys\nfor line in sys.stdin: print(line.rstrip("\\n").upper())')
+
+@benchmark
+def method_overhead():
+    "Per call cost of wrapped methods on small values against calling the function directly"
+    numbers = [3, 1, 2]
+    text = 'a,b'
+    yield 'len', lambda: _(numbers).len(), lambda: len(numbers)
+    yield 'map', lambda: _(numbers).map(str), lambda: tuple(map(str, numbers))
+    yield 'sorted', lambda: _(numbers).sorted(), lambda: sorted(numbers)
+    yield 'join', lambda: _(numbers).join(','), lambda: ','.join(map(str, numbers))
+    yield 'search', lambda: _(text).search(','), lambda: re.search(',', text)
+
+def python_environment():
+    "Environment for python subprocesses that measure with .pyc files, like real startups"
+    environment = dict(os.environ, PYTHONPYCACHEPREFIX=os.path.join(tempfile.gettempdir(), 'fluentpy_benchmark'))
+    environment.pop('PYTHONDONTWRITEBYTECODE', None)
+    return environment
+
+def import_time(repeat=10):
+    "Best cumulative import time of fluentpy in seconds of `repeat` runs of `python -X importtime`"
+    def measure():
+        output = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import fluentpy'], env=python_environment(),
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.PIPE, check=True,
+        ).stderr.decode()
+        own_import, = [line for line in output.splitlines() if line.endswith('| fluentpy')]
+        return int(own_import.split('|')[1]) / 1e6
+    measure() # write .pyc files
+    return min(measure() for _ignored in range(repeat))
+
+def check_import_time(budget=IMPORT_TIME_BUDGET):
+    seconds = import_time()
+    print('%-50s %10.0fus %10.0fus %7s' % ('import fluentpy (budget)', seconds * 1e6, budget * 1e6,
+        'ok' if seconds <= budget else 'FAILED'))
+    return seconds <= budget
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,13 +1,25 @@
-import functools, io, os, operator, sys
+import collections, functools, io, itertools, os, operator, pickle, sys
 
 import unittest
 from unittest.mock import patch
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from pyexpect import expect
 import fluentpy as _
 
 
-class FluentTest(unittest.TestCase): pass
+class FluentTest(unittest.TestCase):
+
+    def register(self, for_type, wrapper_class=None):
+        "Like `_.register()`, but only until the end of the test"
+        if wrapper_class is None:
+            return functools.partial(self.register, for_type)
+        self.addCleanup(_.module._unregister, for_type, wrapper_class)
+        return _.register(for_type, wrapper_class)
 
 class WrapperTest(FluentTest):
     
@@ -55,6 +67,64 @@ class WrapperTest(FluentTest):
         
         expect(_(object())).is_instance(_.Wrapper)
     
+    def test_should_allow_registering_custom_wrappers(self):
+        class Custom(object): pass
+        class CustomWrapper(_.Wrapper):
+            def custom(self): return 'custom'
+        expect(type(_(Custom()))) == _.Wrapper
+        
+        self.register(Custom, CustomWrapper)
+        expect(_(Custom())).is_instance(CustomWrapper)
+        expect(_(Custom()).custom()) == 'custom'
+        
+        @self.register(Custom)
+        class MoreSpecificWrapper(CustomWrapper): pass
+        expect(type(_(Custom()))) == MoreSpecificWrapper
+    
+    def test_should_forget_unregistered_wrappers(self):
+        class Custom(object): pass
+        class CustomWrapper(_.Wrapper): pass
+        _.register(Custom, CustomWrapper)
+        expect(type(_(Custom()))) == CustomWrapper
+        _.module._unregister(Custom, CustomWrapper)
+        expect(type(_(Custom()))) == _.Wrapper
+    
+    def test_should_dispatch_on_the_class_objects_claim_like_isinstance(self):
+        from unittest.mock import Mock
+        expect(_(Mock(spec=dict))).is_instance(_.Mapping)
+        expect(_(Mock(spec=list))).is_instance(_.Iterable)
+        expect(_(1).call(lambda each: Mock(spec=dict))).is_instance(_.Mapping)
+    
+    def test_should_notice_when_types_are_registered_with_abcs_after_wrapping(self):
+        import collections.abc
+        class LateSequence(object):
+            def __getitem__(self, index): raise IndexError
+            def __len__(self): return 0
+        expect(type(_(LateSequence()))) == _.Wrapper
+        collections.abc.Sequence.register(LateSequence)
+        expect(_(LateSequence())).is_instance(_.Iterable)
+    
+    def test_should_notice_new_registrations_for_results_of_wrapped_methods(self):
+        class Custom(object): pass
+        class LateSequence(object):
+            def __getitem__(self, index): raise IndexError
+            def __len__(self): return 0
+        class Factory(object): pass
+        @self.register(Factory)
+        class FactoryWrapper(_.Wrapper):
+            custom = _.module.wrapped(lambda self: Custom())
+            sequence = _.module.wrapped(lambda self: LateSequence())
+        expect(type(_(Factory()).custom())) == _.Wrapper
+        
+        @self.register(Custom)
+        class CustomWrapper(_.Wrapper): pass
+        expect(type(_(Factory()).custom())) == CustomWrapper
+        
+        expect(type(_(Factory()).sequence())) == _.Wrapper
+        import collections.abc
+        collections.abc.Sequence.register(LateSequence)
+        expect(_(Factory()).sequence()).is_instance(_.Iterable)
+    
     def test_should_remember_call_chain(self):
         def foo(): return 'bar'
         expect(_(foo)().unwrap) == 'bar'
@@ -160,6 +230,19 @@ class CallableTest(FluentTest):
         expect(add.curry(_, 'bar', _).curry('foo', _)('baz')._) == 'foobarbaz'
         expect(add.curry(_._1, 'baz', _._0).curry('foo', _)('bar')._) == 'barbazfoo'
     
+    def test_curry_passes_keyword_arguments_through(self):
+        function = _(lambda *args, **kwargs: (args, kwargs))
+        expect(function.curry(_, 'bar', baz='quoox')('foo')._) == (('foo', 'bar'), dict(baz='quoox'))
+        expect(function.curry(_, baz='quoox')('foo', baz='fnord')._) == (('foo',), dict(baz='fnord'))
+        expect(function.curry('foo', _._args)('bar', baz='quoox')._) == (('foo', 'bar'), dict(baz='quoox'))
+    
+    def test_curry_can_return_the_plain_function(self):
+        add_three = _(operator.add).curry(_, 3, unwrap=True)
+        expect(add_three).is_instance(_.Curried)
+        expect(add_three(2)) == 5
+        expect(_([1, 2]).map(add_three)._) == (4, 5)
+        expect(repr(add_three)) == "fluentpy.wrap(<built-in function add>).curry(_._0, 3)"
+    
     # This sounds like a bad idea, for the same reason, why map won't auto wrap it's arguments
     # def test_curry_unwraps_wrapped_arguments(self):
     #     add = _(lambda *args: functools.reduce(operator.add, args))
@@ -168,6 +251,30 @@ class CallableTest(FluentTest):
     def test_compose_cast_wraps_chain(self):
         expect(_(lambda x: x*2).compose(lambda x: x+3)(5)._) == 13
         expect(_(str.strip).compose(str.capitalize)('  fnord  ')._) == 'Fnord'
+    
+    def test_vectorize_broadcasts_over_sequences(self):
+        add = _(operator.add).vectorize()
+        expect(add(1, 2)._) == 3
+        expect(add([1, 2], 10)._) == (11, 12)
+        expect(add([1, 2], [10, 20])._) == (11, 22)
+        expect(add([1, 2], [[10], [20]])._) == ((11, 12), (21, 22))
+        expect(add(['foo', 'bar'], 'baz')._) == ('foobaz', 'barbaz')
+        expect(lambda: add([1, 2], [1, 2, 3])).to_raise(ValueError, 'could not be broadcast')
+    
+    def test_vectorize_only_broadcasts_placeholder_arguments(self):
+        expect(_(operator.contains).vectorize([1, 2], _)([1, 3])._) == (True, False)
+        expect(_(round).vectorize(_, ndigits=1)([1.23, 4.56])._) == (1.2, 4.6)
+    
+    @unittest.skipUnless(numpy, 'requires numpy')
+    def test_vectorize_uses_numpy_for_arrays(self):
+        add = _(lambda x, y: x + y).vectorize()
+        result = add(numpy.arange(3), 10)._
+        expect(result).is_instance(numpy.ndarray)
+        expect(result.tolist()) == [10, 11, 12]
+        expect(result.dtype) == numpy.arange(3).dtype
+        expect(_(numpy.add).vectorize()(numpy.arange(3), [[10], [20]])._.shape) == (2, 3)
+        
+        expect(_(lambda x: x.sum()).vectorize(signature='(n)->()')(numpy.ones((2, 3)))._.tolist()) == [3, 3]
 
 class IterableTest(FluentTest):
     
@@ -217,6 +324,11 @@ class IterableTest(FluentTest):
         # no iterator version of reduce as it's not a mapping
         expect(_((1,2)).reduce(operator.add)._) == 3
     
+    def test_accumulate(self):
+        expect(_((1,2,3)).accumulate()._) == (1, 3, 6)
+        expect(_((1,2,3)).accumulate(operator.mul)._) == (1, 2, 6)
+        expect(_((1,2,3)).accumulate(operator.add, initial=10)._) == (10, 11, 13, 16)
+    
     def test_grouped(self):
         expect(_((1,2,3,4,5,6)).igrouped(2).call(list)._) == [(1,2), (3,4), (5,6)]
         expect(_((1,2,3,4,5,6)).grouped(2)._) == ((1,2), (3,4), (5,6))
@@ -241,6 +353,75 @@ class IterableTest(FluentTest):
             (3, (3,3)),
         )
     
+    def test_hash_group_by_without_sorting(self):
+        expect(_((1,2,1,3,2)).group_by()._) == ((1, (1,1)), (2, (2,2)), (3, (3,)))
+        expect(_(range(7)).igroup_by(_.each % 3, 'count').dictify()._) == {0: 3, 1: 2, 2: 2}
+    
+    def test_group_by_aggregations(self):
+        records = [dict(key='a', value=1), dict(key='b', value=5), dict(key='a', value=3)]
+        def grouped(agg):
+            return _(records).group_by(_.each.key, agg, value=_.each.value).dictify()._
+        expect(grouped('sum')) == dict(a=4, b=5)
+        expect(grouped('min')) == dict(a=1, b=5)
+        expect(grouped('max')) == dict(a=3, b=5)
+        expect(grouped('mean')) == dict(a=2, b=5)
+        expect(grouped('first')) == dict(a=1, b=5)
+        expect(grouped('last')) == dict(a=3, b=5)
+        expect(grouped('collect')) == dict(a=(1, 3), b=(5,))
+        expect(grouped(operator.mul)) == dict(a=3, b=5)
+        expect(grouped(('count', 'sum'))) == dict(a=(2, 4), b=(1, 5))
+        expect(lambda: grouped('median')).to_raise(ValueError, 'needs to be one of')
+    
+    def test_group_by_spills_keys_beyond_max_keys(self):
+        grouped = _(range(10000)).group_by(_.each % 1000, 'sum', max_keys=10)
+        expect(grouped.len()._) == 1000
+        expect(grouped.dictify()._) == {key: sum(range(key, 10000, 1000)) for key in range(1000)}
+        expect(_(range(10)).lazy().group_by(_.each % 2, 'count', max_keys=1).collect()._) == ((0, 5), (1, 5))
+        expect(lambda: _(range(10)).group_by(max_keys=0)).to_raise(ValueError, 'max_keys needs to be at least 1')
+        # only the keys that fit in memory keep their order
+        grouped = _([5, 3, 5, 1, 2, 9, 7, 3]).group_by(max_keys=2, agg='count')._
+        expect(grouped[:2]) == ((5, 2), (3, 2))
+        expect(set(grouped[2:])) == {(1, 1), (2, 1), (9, 1), (7, 1)}
+        expect(lambda: _(range(10)).igroup_by(max_keys=-1)).to_raise(ValueError, 'max_keys needs to be at least 1')
+    
+    def test_fork_feeds_all_consumers_in_one_pass(self):
+        reads = []
+        def numbers():
+            for number in range(1000):
+                reads.append(number)
+                yield number
+        expect(_(numbers()).fork(lambda each: sum(1 for element in each), sum, max, chunk_size=10, max_pending=1)._) == (1000, 499500, 999)
+        expect(reads) == list(range(1000))
+        expect(_([1, 2]).fork(sum)._) == (3,)
+    
+    def test_fork_leaves_out_consumers_that_stop_early(self):
+        expect(_(iter(range(1000))).fork(lambda each: next(iter(each)), sum, chunk_size=1, max_pending=1)._) == (0, 499500)
+    
+    def test_fork_raises_errors_of_consumers_and_source(self):
+        expect(lambda: _(iter(range(10))).fork(lambda each: 1/0, sum)).to_raise(ZeroDivisionError)
+        def failing():
+            yield 1
+            raise KeyError('source')
+        expect(lambda: _(failing()).fork(sum, max)).to_raise(KeyError)
+    
+    def test_bounded_tee_reads_along_with_the_chain(self):
+        seen = []
+        expect(_(iter(range(10))).tee(seen.extend, max_pending=1, chunk_size=2).call(list)._) == list(range(10))
+        expect(seen) == list(range(10))
+        def failing(elements):
+            raise ValueError('side')
+        expect(lambda: _(iter(range(10))).tee(failing, max_pending=1).call(list)).to_raise(ValueError)
+    
+    def test_bounded_tee_continues_when_the_chain_is_dropped(self):
+        import gc, threading
+        done = threading.Event()
+        def side(elements):
+            expect(sum(1 for element in elements)) == 100
+            done.set()
+        _(iter(range(100))).tee(side, max_pending=1, chunk_size=2)
+        gc.collect()
+        expect(done.wait(timeout=5)) == True
+    
     def test_tee_should_not_break_iterators(self):
         # This should work because the extend as well als the .call(list) 
         # should not exhaust the iterator created by .imap()
@@ -261,6 +442,109 @@ class IterableTest(FluentTest):
         expect(_([2,1,3]).isorted(reverse=True).call(list)._) == [3,2,1]
         expect(_([2,1,3]).sorted(reverse=True)._) == (3,2,1)
     
+    def test_sorted_in_runs(self):
+        import random
+        numbers = [random.randrange(100) for index in range(1000)]
+        expect(_(numbers).sorted(run_size=64)._) == tuple(sorted(numbers))
+        expect(_(numbers).sorted(run_size=64, reverse=True)._) == tuple(sorted(numbers, reverse=True))
+        pairs = [(index % 7, index) for index in range(1000)]
+        expect(_(pairs).sorted(key=_.each[0], run_size=10)._) == tuple(sorted(pairs, key=lambda pair: pair[0]))
+        expect(_(iter(range(5))).sorted(run_size=10, reverse=True)._) == (4, 3, 2, 1, 0)
+        expect(_([]).sorted(run_size=10)._) == ()
+        expect(_(range(10)).lazy().sorted(run_size=3, reverse=True).collect()._) == tuple(range(9, -1, -1))
+    
+    def test_unique(self):
+        expect(_([3, 1, 3, 2, 1]).unique()._) == (3, 1, 2)
+        expect(_(['a', 'B', 'b', 'A']).unique(key=str.lower)._) == ('a', 'B')
+        expect(_([[1], [1], [2]]).unique(key=tuple)._) == ([1], [2])
+        expect(_(iter(range(10))).map(_.each % 3).lazy().unique().call(list)._) == [0, 1, 2]
+        expect(_(range(1000)).unique(approx=True, capacity=1000, error_rate=0.0001).len()._) >= 990
+        expect(_(range(100)).map(_.each % 10).unique(approx=True, capacity=100)._) == tuple(range(10))
+        expect(lambda: _([]).unique(approx=True)).to_raise(ValueError, 'needs the expected number')
+    
+    def test_bloom_filter(self):
+        seen = _.BloomFilter(capacity=100, error_rate=0.01)
+        expect(seen.add('foo')) == False
+        expect(seen.add('foo')) == True
+        expect('foo' in seen) == True
+        expect('bar' in seen) == False
+        expect(len(seen)) == 1
+        expect(seen.hash_count) == 7
+        expect(len(seen.bits)) == 120
+        # hash(-1) == hash(-2) and hash() is the number modulo 2**61-1
+        expect(_([-1, -2, -1, 2**61 + 3, 4]).unique(approx=True, capacity=10)._) == (-1, -2, 2**61 + 3, 4)
+        expect(_([1, 1.0, True]).unique(approx=True, capacity=10)._) == (1,)
+    
+    def test_approx_distinct(self):
+        sketch = _(range(10000)).map(str).approx_distinct()._
+        expect(sketch).is_instance(_.HyperLogLog)
+        expect(abs(sketch.estimate() - 10000)) < 300
+        expect(len(_(['a', 'b', 'a']).approx_distinct()._)) == 2
+        shards = [_.HyperLogLog(10).update(range(start, start + 5000)) for start in (0, 2500)]
+        expect(abs(len(shards[0] | shards[1]) - 7500)) < 600
+        expect(lambda: _.HyperLogLog(10) | _.HyperLogLog(12)).to_raise(ValueError, 'precision needs to be')
+    
+    def test_heavy_hitters(self):
+        stream = [1] * 50 + [2] * 30 + list(range(3, 23))
+        sketch = _(iter(stream)).heavy_hitters(4)._
+        expect(sketch.most_common(2)[0][0]) == 1
+        expect(sketch.most_common(2)[1][0]) == 2
+        expect(sketch[1]) >= 50 - sketch.error
+        expect(sketch[1]) <= 50
+        merged = _.MisraGries(4).update(stream[:50]) | _.MisraGries(4).update(stream[50:])
+        expect(merged.total) == 100
+        expect(len(merged.counters)) <= 4
+        expect(dict(merged.most_common(2)).keys()) == {1, 2}
+    
+    def test_approx_quantiles(self):
+        import random
+        values = list(range(100000))
+        random.shuffle(values)
+        sketch = _(values).lazy().approx_quantiles(k=100)._
+        expect(sum(map(len, sketch.levels))) < 400
+        low, median, high = sketch.quantiles(0.1, 0.5, 0.99)
+        expect(abs(low - 10000)) < 3000
+        expect(abs(median - 50000)) < 3000
+        expect(abs(high - 99000)) < 3000
+        expect(abs(sketch.rank(25000) - 0.25)) < 0.03
+        merged = _.KLL(100).update(values[:50000]) | _.KLL(100).update(values[50000:])
+        expect(merged.total) == 100000
+        expect(abs(merged.quantile(0.5) - 50000)) < 3000
+        expect(_([3, 1, 2]).approx_quantiles()._.quantiles(0, 0.5, 1)) == (1, 2, 3)
+    
+    def test_join_on(self):
+        orders = [('o1', 'a'), ('o2', 'b'), ('o3', 'a'), ('o4', 'x')]
+        customers = [('a', 'Alice'), ('b', 'Bob'), ('c', 'Carol')]
+        def joined(left, right, how):
+            return _(left).join_on(right, _.each[1], _.each[0], how=how).map(
+                lambda pair: tuple(element and element[0] for element in pair))._
+        expect(joined(orders, customers, 'inner')) == (('o1', 'a'), ('o2', 'b'), ('o3', 'a'))
+        expect(joined(orders, customers, 'left')) == (('o1', 'a'), ('o2', 'b'), ('o3', 'a'), ('o4', None))
+        expect(joined(orders, customers, 'right')) == (('o1', 'a'), ('o2', 'b'), ('o3', 'a'), (None, 'c'))
+        expect(joined(orders, customers, 'outer')) == (('o1', 'a'), ('o2', 'b'), ('o3', 'a'), ('o4', None), (None, 'c'))
+        # indexes the shorter self and streams other, the pairs still are (self, other)
+        expect(_(customers).join_on(orders, _.each[0], _.each[1], how='left').map(
+            lambda pair: tuple(element and element[0] for element in pair))._) == \
+            (('a', 'o1'), ('b', 'o2'), ('a', 'o3'), ('c', None))
+        expect(_([1, 2]).ijoin_on(iter([2, 3]), _.each).call(list)._) == [(2, 2)]
+        expect(lambda: _([]).join_on([], _.each, how='cross')).to_raise(ValueError, 'how needs to be one of')
+    
+    def test_merge_join(self):
+        left = [(1, 'a'), (2, 'b'), (2, 'c'), (4, 'd')]
+        right = [(2, 'x'), (2, 'y'), (3, 'z')]
+        def joined(how):
+            return _(iter(left)).merge_join(iter(right), _.each[0], how=how).map(
+                lambda pair: tuple(element and element[1] for element in pair))._
+        expect(joined('inner')) == (('b', 'x'), ('b', 'y'), ('c', 'x'), ('c', 'y'))
+        expect(joined('left')) == ((('a', None),) + joined('inner') + (('d', None),))
+        expect(joined('outer')) == ((('a', None),) + joined('inner') + ((None, 'z'), ('d', None)))
+        expect(_(left).lazy().merge_join(right, _.each[0], how='right').len()._) == 5
+    
+    def test_nsmallest_and_nlargest(self):
+        expect(_([5, 1, 4, 2, 3]).nsmallest(2)._) == (1, 2)
+        expect(_([5, 1, 4, 2, 3]).nlargest(2)._) == (5, 4)
+        expect(_(['aaa', 'b', 'cc']).top_k(2, key=len)._) == ('aaa', 'cc')
+    
     def test_flatten(self):
         expect(_([(1,2),[3,4],(5, [6,7])]).iflatten().call(list)._) == \
             [1,2,3,4,5,6,7]
@@ -269,6 +553,24 @@ class IterableTest(FluentTest):
         
         expect(_([(1,2),[3,4],(5, [6,7])]).flatten(level=1)._) == \
             (1,2,3,4,5,[6,7])
+        expect(_([[1, [2, [3]]]]).flatten(level=2)._) == (1, 2, [3])
+        expect(_([]).flatten()._) == ()
+    
+    def test_flatten_keeps_strings_bytes_and_mappings_whole(self):
+        expect(_(['foo', [b'bar', [{'a': 1}, bytearray(b'baz')]]]).flatten()._) == \
+            ('foo', b'bar', {'a': 1}, bytearray(b'baz'))
+    
+    def test_flatten_with_custom_leaves(self):
+        expect(_([(1, 2), [3, (4,)]]).flatten(leaf=lambda each: isinstance(each, tuple))._) == ((1, 2), 3, (4,))
+        # strings stay whole with a predicate too, single characters would nest forever
+        expect(_(['ab', ['c']]).flatten(leaf=lambda each: False)._) == ('ab', 'c')
+        expect(_(['ab', ('x',)]).flatten(leaf=lambda each: isinstance(each, tuple))._) == ('ab', ('x',))
+    
+    def test_flatten_deeply_nested_without_recursion(self):
+        nested = [0]
+        for index in range(1, sys.getrecursionlimit() * 2):
+            nested = [nested, index]
+        expect(_(nested).flatten()._) == tuple(range(sys.getrecursionlimit() * 2))
     
     def test_star_call(self):
         expect(_([1,2,3]).star_call(str.format, '{} - {} : {}')._) == '1 - 2 : 3'
@@ -293,6 +595,217 @@ class IterableTest(FluentTest):
         expect(_(i for i in range(10)).get(0, 'fnord')._) == 0
         expect(_(i for i in range(10)).get(11, 'fnord')._) == 'fnord'
 
+    def test_grep_and_sub(self):
+        import re
+        expect(_(['foo', 'bar', 'baz']).grep(r'^ba')._) == ('bar', 'baz')
+        expect(_(['foo', 'BAR']).grep('bar', re.IGNORECASE)._) == ('BAR',)
+        expect(_(['foo', 'bar']).grep(re.compile('o'))._) == ('foo',)
+        expect(next(_(['foo', 'bar']).igrep('b')._)) == 'bar'
+        
+        expect(_(['foo', 'bar']).sub(r'[ao]', '_')._) == ('f__', 'b_r')
+        expect(_(['foo', 'bar']).sub(r'[ao]', '_', count=1)._) == ('f_o', 'b_r')
+        expect(_(['foo', 'bar']).lazy().grep('o').sub('o', 'a').collect()._) == ('faa',)
+
+class LazyTest(FluentTest):
+
+    def test_should_only_record_steps_until_a_result_is_needed(self):
+        calls = []
+        def record(x):
+            calls.append(x)
+            return x
+        pipeline = _([1,2,3]).lazy().map(record).filter(lambda x: x > 1)
+        expect(pipeline).is_instance(_.Lazy)
+        expect(pipeline.steps) == ('map', 'filter')
+        expect(calls) == []
+        expect(pipeline.collect()._) == (2, 3)
+        expect(calls) == [1, 2, 3]
+    
+    def test_should_process_elements_one_after_the_other(self):
+        events = []
+        def first(x): events.append(('first', x)); return x
+        def second(x): events.append(('second', x)); return x
+        _([1,2]).lazy().map(first).map(second).collect()
+        expect(events) == [('first', 1), ('second', 1), ('first', 2), ('second', 2)]
+    
+    def test_terminals(self):
+        pipeline = _(range(10)).lazy().map(_.each * 2).filter(_.each > 4)
+        expect(pipeline.sum()._) == 84
+        expect(pipeline.len()._) == 7
+        expect(pipeline.reduce(max)._) == 18
+        expect(pipeline.map(str).join(',')._) == '6,8,10,12,14,16,18'
+        expect(pipeline.collect()).is_instance(_.Iterable)
+        expect(pipeline.collect()).not_.is_instance(_.Lazy)
+    
+    def test_steps(self):
+        expect(_([(1,2), (3,4)]).lazy().star_map(lambda x, y: x+y).collect()._) == (3, 7)
+        expect(_('ab').call(list).lazy().enumerate().collect()._) == ((0, 'a'), (1, 'b'))
+        expect(_([[1, [2]], [3]]).lazy().flatten().collect()._) == (1, 2, 3)
+        expect(_([2,1,3]).lazy().sorted().reversed().collect()._) == (3, 2, 1)
+        expect(_([1,2,3]).lazy().zip('abc').collect()._) == ((1, 'a'), (2, 'b'), (3, 'c'))
+    
+    def test_should_not_materialize_intermediate_results(self):
+        import tracemalloc
+        tracemalloc.start()
+        try:
+            _(range(100000)).lazy().map(_.each + 1).filter(_.each % 2).map(_.each * 2).sum()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        expect(peak) < 100000
+
+class ReplayableTest(FluentTest):
+
+    def counting(self, reads):
+        for index in itertools.count():
+            reads.append(index)
+            yield index
+    
+    def test_should_only_read_as_far_as_accessed(self):
+        reads = []
+        replay = _(self.counting(reads)).replayable()
+        expect(reads) == []
+        expect(replay.get(2)._) == 2
+        expect(reads) == [0, 1, 2]
+        expect(replay[:5]._) == (0, 1, 2, 3, 4)
+        expect(replay.get(1, 'default')._) == 1
+        expect(reads) == [0, 1, 2, 3, 4]
+        expect(replay.unwrap.buffered) == 5
+    
+    def test_should_replay_iterators_as_often_as_needed(self):
+        replay = _(iter(range(5))).memoize()
+        expect(replay.map(str)._) == ('0', '1', '2', '3', '4')
+        expect(replay.sum()._) == 10
+        expect(replay.len()._) == 5
+        expect(replay[-1]._) == 4
+        expect(replay[1:4:2]._) == (1, 3)
+        expect(replay.get(5, 'default')._) == 'default'
+        expect(lambda: replay[5]).to_raise(IndexError)
+        expect(lambda: replay.get(5)).to_raise(IndexError)
+    
+    def test_should_replay_interleaved_iterations(self):
+        replay = _(iter(range(3))).replayable().unwrap
+        first, second = iter(replay), iter(replay)
+        expect([next(first), next(second), next(second), next(first)]) == [0, 0, 1, 1]
+        expect(list(first)) == [2]
+    
+    def test_should_spill_to_disk_beyond_buffer_size(self):
+        replay = _(iter(range(100))).replayable(buffer_size=10)
+        expect(replay.sum()._) == 4950
+        expect(replay.unwrap._elements).has_len(10)
+        expect(replay.sum()._) == 4950
+        expect(replay[3]._) == 3
+        expect(replay[95]._) == 95
+        expect(replay[::25]._) == (0, 25, 50, 75)
+        replay.unwrap.close()
+        expect(replay.unwrap.buffered) == 0
+        expect(replay.len()._) == 0
+        expect(lambda: replay[3]).to_raise(IndexError)
+    
+    def test_should_slice_backwards(self):
+        reads = []
+        replay = _(self.counting(reads)).replayable()
+        expect(replay[5:2:-1]._) == (5, 4, 3)
+        expect(reads) == [0, 1, 2, 3, 4, 5]
+        expect(replay[5:0:-2]._) == (5, 3, 1)
+        expect(_(iter(range(10))).replayable()[::-3]._) == (9, 6, 3, 0)
+        expect(_(iter(range(10))).replayable()[-2:5:-1]._) == (8, 7, 6)
+        expect(_(iter(range(3))).replayable()[5:0:-1]._) == (2, 1)
+    
+    def test_should_replay_lazy_pipelines(self):
+        replay = _(range(10)).lazy().map(_.each * 2).replayable()
+        expect(replay[:3]._) == (0, 2, 4)
+        expect(replay.unwrap.buffered) == 3
+        expect(replay.replayable()).is_(replay)
+
+class ParallelTest(FluentTest):
+
+    @classmethod
+    def setUpClass(cls):
+        import concurrent.futures
+        cls.executor = concurrent.futures.ProcessPoolExecutor(2)
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+    
+    def test_pmap(self):
+        expect(_(range(10)).pmap(_.each * 2, chunk_size=3, executor=self.executor)._) == tuple(range(0, 20, 2))
+        expect(_(range(10)).pmap(_(operator.mul).curry(_, 3), executor=self.executor)._) == tuple(range(0, 30, 3))
+        expect(_(range(10)).pmap(_.each, executor=self.executor)._) == tuple(range(10))
+        expect(_([]).pmap(abs, executor=self.executor)._) == ()
+        
+        expect(_(range(10)).ipmap(_.each * 2, executor=self.executor)).is_instance(_.Iterable)
+    
+    def test_pstar_map_and_pfilter(self):
+        expect(_([(1, 2), (3, 4)]).pstar_map(operator.add, executor=self.executor)._) == (3, 7)
+        expect(_(range(10)).pfilter(_.each % 2, chunk_size=2, executor=self.executor)._) == (1, 3, 5, 7, 9)
+    
+    def test_unordered_results(self):
+        result = _(range(100)).pmap(_.each + 1, chunk_size=7, ordered=False, executor=self.executor)._
+        expect(sorted(result)) == list(range(1, 101))
+    
+    def test_only_keeps_a_bounded_number_of_chunks_in_flight(self):
+        results = _(itertools.count()).ipmap(_.each * 2, chunk_size=5, max_pending=2, executor=self.executor)._
+        expect(tuple(itertools.islice(results, 12))) == tuple(range(0, 24, 2))
+        results.close()
+    
+    def test_uses_its_own_process_pool_by_default(self):
+        expect(_(range(5)).pmap(_.each * 2, max_workers=2)._) == (0, 2, 4, 6, 8)
+    
+    def test_lazy_pipelines_can_run_steps_in_parallel(self):
+        pipeline = _(range(10)).lazy().pmap(_.each * 2, executor=self.executor).filter(_.each > 10)
+        expect(pipeline.steps) == ('pmap', 'filter')
+        expect(pipeline.sum()._) == 12 + 14 + 16 + 18
+    
+    def test_should_pickle_each_expressions_and_curried_functions(self):
+        expression = pickle.loads(pickle.dumps(_.each['price'] * _.each.call.get('quantity', 1) + 3))
+        expect(expression(dict(price=2, quantity=4))) == 11
+        
+        curried = pickle.loads(pickle.dumps(_(operator.add).curry(_, 'bar')))
+        expect(curried('foo')._) == 'foobar'
+        expect(pickle.loads(pickle.dumps(_(operator.add).curry(_._1, _._0).unwrap))('foo', 'bar')) == 'barfoo'
+        
+        expect(pickle.loads(pickle.dumps(_.each))).is_(_.each)
+        expect(pickle.loads(pickle.dumps(_((1, 2))))._) == (1, 2)
+
+class AsyncIterableTest(FluentTest):
+
+    async def numbers(self, count=6):
+        for number in range(count):
+            yield number
+    
+    def test_should_wrap_async_iterables(self):
+        expect(_(self.numbers())).is_instance(_.AsyncIterable)
+        expect(_([1, 2]).aiter()).is_instance(_.AsyncIterable)
+    
+    def test_amap_afilter_and_aflatten(self):
+        import asyncio
+        async def double(number):
+            return number * 2
+        expect(asyncio.run(_(self.numbers()).amap(double).afilter(_.each > 4).acollect())._) == (6, 8, 10)
+        expect(asyncio.run(_(self.numbers()).afilter(_.each % 2).acollect())._) == (1, 3, 5)
+        expect(asyncio.run(_([1, [2, ('foo', [3])]]).aiter().aflatten().acollect())._) == (1, 2, 'foo', 3)
+        expect(asyncio.run(_([1, [2, [3]]]).aiter().aflatten(level=1).acollect())._) == (1, 2, [3])
+    
+    def test_amap_limits_concurrency(self):
+        import asyncio
+        in_flight, maximum_in_flight = [0], [0]
+        async def slow(number):
+            in_flight[0] += 1
+            maximum_in_flight[0] = max(maximum_in_flight[0], in_flight[0])
+            await asyncio.sleep(0.005 * (10 - number))
+            in_flight[0] -= 1
+            return number
+        
+        expect(asyncio.run(_(self.numbers(10)).amap(slow, concurrency=3).acollect())._) == tuple(range(10))
+        expect(maximum_in_flight[0]) == 3
+        
+        maximum_in_flight[0] = 0
+        result = asyncio.run(_(self.numbers(10)).amap(slow, concurrency=10, ordered=False).acollect())._
+        expect(sorted(result)) == list(range(10))
+        expect(result[0]) == 9 # sleeps the shortest
+        expect(maximum_in_flight[0]) == 10
+
 class MappingTest(FluentTest):
     
     def test_should_call_callable_with_double_star_splat_as_keyword_arguments(self):
@@ -334,6 +847,75 @@ class StrTest(FluentTest):
         expect(_('bazfoobar').sub(r'ba.', 'foo')._) == 'foofoofoo'
         expect(_('bazfoobar').sub(r'ba.', 'foo', 1)._) == 'foofoobar'
         expect(_('bazfoobar').sub(r'ba.', 'foo', count=1)._) == 'foofoobar'
+    
+    def test_regex_methods_accept_flags_and_compiled_patterns(self):
+        import re
+        expect(_('Foo').match('foo', re.IGNORECASE).group()._) == 'Foo'
+        expect(_('foo bar').fullmatch(r'foo').unwrap).is_none()
+        expect(_('foo bar').search(re.compile(r'b.r')).group()._) == 'bar'
+        expect(lambda: _('foo').search(re.compile('foo'), re.IGNORECASE)).to_raise(ValueError)
+    
+    def test_regex_cache(self):
+        cache = _.RegexCache(maxsize=2)
+        expect(cache.compile('foo')).is_(cache.compile('foo'))
+        expect(cache.info()) == dict(hits=1, misses=1, maxsize=2, size=1)
+        
+        cache.compile('bar')
+        cache.compile('foo') # now bar is the least recently used pattern
+        cache.compile('baz')
+        expect(cache.info()) == dict(hits=2, misses=3, maxsize=2, size=2)
+        cache.compile('foo')
+        expect(cache.info()['hits']) == 3
+        cache.compile('bar')
+        expect(cache.info()['misses']) == 4
+        
+        cache.clear()
+        expect(cache.info()) == dict(hits=0, misses=0, maxsize=2, size=0)
+        
+        expect(_.regex_cache).is_instance(_.RegexCache)
+
+class BytesTest(FluentTest):
+
+    def test_should_wrap_bytes_like_objects(self):
+        for value in (b'foo', bytearray(b'foo'), memoryview(b'foo')):
+            expect(_(value)).is_instance(_.Bytes)
+        expect(_(b'foo').map(_.each + 1)._) == (103, 112, 112)
+    
+    def test_regex_methods(self):
+        expect(_(b'foo bar').search(rb'b.r').span()._) == (4, 7)
+        expect(_(memoryview(b'foo bar')).findall(rb'[fb]\w')._) == [b'fo', b'ba']
+        expect(_(bytearray(b'foo bar')).sub(rb'o+', b'0')._) == b'f0 bar'
+        expect(_(b'foo bar').finditer(rb'\w+').map(_.each.call.group())._) == (b'foo', b'bar')
+    
+    def test_lines_and_records_are_memoryview_slices(self):
+        data = b'foo\nbar\n\nbaz'
+        lines = _(data).lines()._
+        expect(lines).has_len(4)
+        expect(lines[0]).is_instance(memoryview)
+        expect(lines[0].obj).is_(data)
+        expect(tuple(map(bytes, lines))) == (b'foo', b'bar', b'', b'baz')
+        expect(_(data).lines(keepends=True).map(bytes)._) == (b'foo\n', b'bar\n', b'\n', b'baz')
+        expect(_(b'foo\n').lines().map(bytes)._) == (b'foo',)
+        expect(_(b'').lines()._) == ()
+        
+        expect(_(memoryview(b'a;;b;c')).records(b';;').map(bytes)._) == (b'a', b'b;c')
+        expect(_(b'abcdefg').blocks(3).map(bytes)._) == (b'abc', b'def', b'g')
+        expect(_(b'foo\nbar').ilines().igrep(b'b').map(bytes)._) == (b'bar',)
+    
+    def test_mmap(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'log')
+            with open(path, 'wb') as file:
+                file.write(b'user=foo\nuser=bar\n')
+            
+            mapped = _.mmap(path)
+            expect(mapped).is_instance(_.Bytes)
+            expect(mapped.findall(rb'user=(\w+)')._) == [b'foo', b'bar']
+            expect(mapped.lines().map(bytes)._) == (b'user=foo', b'user=bar')
+            
+            open(path, 'wb').close()
+            expect(_.mmap(path).lines()._) == ()
 
 class ImporterTest(FluentTest):
     
@@ -369,6 +951,27 @@ class ImporterTest(FluentTest):
             _.lib.os.path.reload()
             expect(sensed['args']) == (_.lib.os.path._, )
 
+    def test_should_cache_resolved_attributes(self):
+        expect(_.lib.os.path.join).is_(_.lib.os.path.join)
+        expect(_.lib.os).is_(_.lib.os)
+        
+        with patch('os.path.join', lambda *args: 'patched'):
+            expect(_.lib.os.path.join('foo')._) == 'patched'
+        expect(_.lib.os.path.join('foo', 'bar')._) == os.path.join('foo', 'bar')
+    
+    def test_lazy_lib_should_only_import_on_first_use(self):
+        from subprocess import check_output
+        output = check_output(['python', '-c', 'import sys, fluentpy as _; '
+            'parser = _.lazy_lib.email.parser; print("email.parser" in sys.modules, type(parser._).__name__); '
+            'parser.Parser; print(type(parser._).__name__, _.import_timings().map(_.each[0]).sorted()._)'])
+        expect(output.decode().splitlines()) == [
+            'True _LazyModule', "module ('email', 'email.parser')"]
+    
+    def test_lazy_lib_behaves_like_lib(self):
+        expect(_.lazy_lib.os.path.join('foo', 'bar')._) == os.path.join('foo', 'bar')
+        expect(lambda: _.lazy_lib.does_not_exist_anywhere).to_raise(ModuleNotFoundError)
+        expect(lambda: _.lazy_lib.os.does_not_exist_anywhere).to_raise(AttributeError)
+
 class EachTest(FluentTest):
     
     def test_should_produce_attrgetter_on_attribute_access(self):
@@ -376,6 +979,13 @@ class EachTest(FluentTest):
             bar = 'baz'
         expect(_([Foo(), Foo()]).map(_.each.bar)._) == ('baz', 'baz')
     
+    def test_should_prefer_items_of_mappings_like_wrapped_mappings(self):
+        records = [{'items': [1, 2], 'get': 3}]
+        expect(_(records).map(_.each.items)._) == ([1, 2],)
+        expect(_(records).map(_.each.get + 1)._) == (4,)
+        expect(_(records[0]).items._) == [1, 2]
+        expect(_([{}]).map(_.each.copy)._[0]).is_instance(type({}.copy))
+    
     def test_should_produce_itemgetter_on_item_access(self):
         expect(_([['foo'], ['bar']]).map(_.each[0])._) == ('foo', 'bar')
     
@@ -384,6 +994,12 @@ class EachTest(FluentTest):
         expect(_([3, 5]).map(_.each + 3)._) == (6, 8)
         expect(_([3, 5]).map(_.each < 4)._) == (True, False)
     
+    def test_should_keep_negative_constants_together(self):
+        expect(_([1, 2]).map((-2) ** _.each)._) == (-2, 4)
+        expect(_([1, 2]).map((-2.5) ** _.each)._) == (-2.5, 6.25)
+        expect(_([1, 2]).map(-1 - _.each)._) == (-2, -3)
+        expect(repr((-2) ** _.each)) == "fluentpy.each expression: ((-2) ** each)"
+    
     def test_should_produce_callable_on_unary_operator(self):
         expect(_([3, 5]).map(- _.each)._) == (-3, -5)
         expect(_([3, 5]).map(~ _.each)._) == (-4, -6)
@@ -403,6 +1019,63 @@ class EachTest(FluentTest):
         expect(_([dict(first='foo')]).map(_.each.first)._) == ('foo',)
         
     
+    def test_should_combine_expressions(self):
+        expect(_([1, 2]).map((_.each + 3) * 2)._) == (8, 10)
+        expect(_([1, 2]).map(10 - _.each)._) == (9, 8)
+        expect(_([1, 2]).map(_.each * _.each)._) == (1, 4)
+        expect(_([1, 2]).map(-(_.each + 1))._) == (-2, -3)
+        expect(_([-1, 2]).map(abs(_.each) ** 2)._) == (1, 4)
+        expect(_([1, 5]).filter((_.each % 2 == 1) & (_.each > 2))._) == (5,)
+    
+    def test_should_combine_attribute_item_and_method_access(self):
+        class Item(object):
+            def __init__(self, price, quantity):
+                self.price, self.quantity = price, quantity
+        expect(_([Item(2, 3), Item(4, 5)]).map(_.each.price * _.each.quantity + 1)._) == (7, 21)
+        expect(_([dict(name='foo')]).map(_.each['name'].call.upper() + '!')._) == ('FOO!',)
+        expect(_([dict(name='foo')]).map(_.each.name.call.replace('o', '0', 1))._) == ('f0o',)
+    
+    def test_attribute_access_on_mappings_uses_items_first(self):
+        class Record(dict): pass
+        class WithAttributes(dict):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.name = 'attribute'
+        records = [dict(name='dict'), Record(name='record'), WithAttributes(name='item'), WithAttributes()]
+        expect(_(records).map(_.each.name)._) == ('dict', 'record', 'item', 'attribute')
+        expect(_([dict(keys=1), dict()]).map(_.each.keys)._[0]) == 1
+        expect(_([dict(keys=1), dict()]).map(_.each.keys)._[1]).is_instance(type({}.keys))
+        expect(_([dict(keys=1, values=2)]).map(_.each.pick('keys', 'values'))._) == ((1, 2),)
+        expect(_([dict(keys=1)]).map(_.each.pick('keys', 'values'))._[0][1]).is_instance(type({}.values))
+        counts = collections.defaultdict(int, a=1)
+        expect(lambda: _([counts]).map(_.each.pick('a', 'b'))).to_raise(AttributeError)
+        expect(counts) == dict(a=1)
+        expect(lambda: _([dict()]).map(_.each.name)).to_raise(AttributeError)
+        expect(_([dict(inner=dict(name='foo'))]).map(_.each.inner.name)._) == ('foo',)
+    
+    def test_should_extract_several_items_or_attributes(self):
+        class Item(object):
+            def __init__(self, price, quantity):
+                self.price, self.quantity, self.details = price, quantity, dict(color='red')
+        records = [dict(price=1, quantity=2, details=dict(color='blue'))]
+        expect(_(records).map(_.each['price', 'quantity'])._) == ((1, 2),)
+        expect(_(records).map(_.each.pick('price', 'quantity'))._) == ((1, 2),)
+        expect(_(records).map(_.each.pick('price', 'details.color'))._) == ((1, 'blue'),)
+        expect(_([Item(3, 4)]).map(_.each.pick('price', 'quantity'))._) == ((3, 4),)
+        expect(_([Item(3, 4)]).map(_.each.pick('quantity', 'details.color'))._) == ((4, 'red'),)
+        expect(_([Item(3, 4)]).map(_.each.pick('price'))._) == ((3,),)
+        expect(_([{('a', 1): 'tuple key'}]).map(_.each['a', 1])._) == ('tuple key',)
+        expect(repr(_.each['a', 'b'])) == "fluentpy.each expression: each['a', 'b']"
+        expect(repr(_.each.pick('a', 'b.c'))) == "fluentpy.each expression: each.pick('a', 'b.c')"
+        expect(pickle.loads(pickle.dumps(_.each.pick('a')))(dict(a=1))) == (1,)
+    
+    def test_expressions_have_readable_repr(self):
+        expect(repr((_.each.foo['bar'] + 3) * 2)) == "fluentpy.each expression: ((each.foo['bar'] + 3) * 2)"
+        expect(repr(_.each.call.foo(1, bar=2))) == "fluentpy.each expression: each.foo(1, bar=2)"
+    
+    def test_wrapped_methods_call_the_compiled_function(self):
+        expect(_(1).call(lambda value, function: function.__name__, _.each + 1)._) == 'each_expression'
+    
     def _test_should_allow_creating_callables_without_call(self):
         # This is likely not possible to attain due to the shortcomming that .foo already
         # needs to create the attgetter, and we cannot distinguish a call to it from the calls map, etc. do
@@ -468,6 +1141,131 @@ class SmallTalkLikeBehaviour(FluentTest):
             foo = 'bar'
         expect(_(Attr()).setattr('foo', 'baz').self.foo._) == 'baz'
 
+class ProfileTest(FluentTest):
+
+    def test_should_record_every_step_of_a_chain(self):
+        with _.profile() as profiled:
+            _([3, 1, 2]).sorted().map(str).join(',')
+        expect([record['step'] for record in profiled.records]) == ['sorted()', "map(<class 'str'>)", "join(',')"]
+        sorted_record = profiled.records[0]
+        expect(sorted_record).has_subdict(elements_in=3, elements_out=3)
+        expect(sorted_record['wall']) >= 0
+        expect(sorted_record['cpu']) >= 0
+        expect(sorted_record['memory']) >= 0
+        expect(profiled.records[2]['elements_out']).is_none()
+    
+    def test_should_only_record_outermost_steps(self):
+        with _.profile(memory=False) as profiled:
+            _([1, 1, 2]).groupby()
+        expect(profiled.records).has_len(1)
+        expect(profiled.records[0]).has_subdict(step='groupby()', memory=None)
+    
+    def test_should_name_eager_variants_like_the_method_called(self):
+        with _.profile(memory=False) as profiled:
+            _([[2], [1]]).flatten().isorted().call(list)
+        expect([record['step'] for record in profiled.records]) == ['flatten()', 'isorted()', "call(<class 'list'>)"]
+        # only where the eager variant is the method without the i
+        tupleized = _.module.tupleize(_.module.Iterable.map)
+        expect(_.module._tupleized_step_name(_([1]), 'index', tupleized)) == 'index'
+    
+    def test_should_record_calls_of_methods_of_wrapped_values(self):
+        with _.profile(memory=False) as profiled:
+            _('foo').upper()
+        expect([record['step'] for record in profiled.records]) == ["getattr('upper')", 'upper()']
+    
+    def test_should_list_lazy_steps_below_their_terminal(self):
+        with _.profile(memory=False) as profiled:
+            expect(_(range(10)).lazy().map(_.each * 2).filter(_.each > 4).sum()._) == 84
+        terminal, = profiled.records
+        expect(terminal['step']) == 'sum()'
+        expect([(stage['step'], stage['elements_in'], stage['elements_out']) for stage in terminal['stages']]) == [
+            ('lazy source', None, 10), ('map', 10, 10), ('filter', 10, 7),
+        ]
+    
+    def test_should_stop_recording_after_the_with_block(self):
+        with _.profile(memory=False) as profiled:
+            _([1]).len()
+        _([1]).len()
+        expect(profiled.records).has_len(1)
+    
+    def test_should_print_table_and_json(self):
+        import json
+        with _.profile() as profiled:
+            _(range(10)).map(str)
+        expect(str(profiled)).contains('wall ms')
+        expect(str(profiled)).contains("map(<class 'str'>)")
+        expect(json.loads(profiled.json())['records'][0]['elements_out']) == 10
+
+class HistoryTest(FluentTest):
+
+    def chain(self, **kwargs):
+        return _([3, 1, 2], **kwargs).sorted().map(_.each * 2).call(list)
+    
+    def test_full_history_keeps_all_previous_wrappers(self):
+        expect(self.chain().previous.previous.previous._) == [3, 1, 2]
+    
+    def test_last_history_only_keeps_the_previous_wrapper(self):
+        chained = self.chain(history='last')
+        expect(chained._) == [2, 4, 6]
+        expect(chained.previous._) == (2, 4, 6)
+        expect(chained.previous.previous).is_none()
+    
+    def test_weak_history_allows_intermediate_results_to_be_collected(self):
+        chained = self.chain(history='weak')
+        expect(chained._) == [2, 4, 6]
+        import gc; gc.collect()
+        expect(chained.previous).is_none()
+    
+    def test_chaining_off_of_none_works_with_all_policies(self):
+        for policy in ('full', 'last', 'weak'):
+            expect(_([3,2,1], history=policy).sort().self.reverse().self._) == [3,2,1]
+    
+    def test_should_select_policy_globally_and_with_context_manager(self):
+        with _.history('last'):
+            expect(self.chain().previous.previous).is_none()
+            with _.history('weak'):
+                self.chain().previous # no error
+            expect(self.chain().previous.previous).is_none()
+        expect(self.chain().previous.previous._) == (1, 2, 3)
+        
+        _.history('last')
+        self.addCleanup(_.history, 'full')
+        expect(self.chain().previous.previous).is_none()
+        
+        expect(lambda: _.history('none')).to_raise(ValueError, 'needs to be one of')
+    
+    def test_policy_should_be_scoped_to_thread_and_task(self):
+        import asyncio, threading
+        thread = threading.Thread(target=_.history, args=('last',))
+        thread.start()
+        thread.join()
+        expect(self.chain().previous.previous._) == (1, 2, 3)
+        
+        async def chain_in_task(policy, wait):
+            with _.history(policy):
+                await asyncio.sleep(wait)
+                return self.chain().previous.previous
+        async def both():
+            return await asyncio.gather(chain_in_task('last', 0.02), chain_in_task('full', 0.01))
+        last, full = asyncio.run(both())
+        expect(last).is_none()
+        expect(full._) == (1, 2, 3)
+    
+    def test_long_chains_should_not_keep_intermediate_results_alive(self):
+        import tracemalloc
+        def memory_held_by_chain(policy):
+            tracemalloc.start()
+            try:
+                chained = _(list(range(10000)), history=policy)
+                for ignored in range(20):
+                    chained = chained.map(_.each + 1)
+                return tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+        full = memory_held_by_chain('full')
+        expect(memory_held_by_chain('last')) < full / 5
+        expect(memory_held_by_chain('weak')) < full / 5
+
 class IntegrationTest(FluentTest):
     
     def test_extrac_and_decode_URIs(self):
@@ -485,6 +1283,43 @@ class IntegrationTest(FluentTest):
             input=b'foo\nbar\nbaz')
         expect(output) == b'FOO\nBAR\nBAZ\n'
     
+    def test_call_module_per_line_from_shell(self):
+        from subprocess import check_output
+        output = check_output(['python', '-m', 'fluentpy', '-p', "_(line).upper() if line != 'bar' else None"],
+            input=b'foo\nbar\nbaz\n')
+        expect(output) == b'FOO\nBAZ\n'
+        
+        output = check_output(['python', '-m', 'fluentpy', '-n', "_(line).split(',').len().print()"],
+            input=b'a,b\nc\n\xff')
+        expect(output) == b'2\n1\n1\n'
+        
+        # undecodable input is passed through
+        output = check_output(['python', '-m', 'fluentpy', '-p', 'line'], input=b'f\xf6\xf6\n', env=dict(os.environ, LANG='C.UTF-8'))
+        expect(output) == b'f\xf6\xf6\n'
+        
+        # output is encoded for stdout, input decoded for stdin
+        output = check_output(['python', '-c', 'import io, sys, fluentpy; '
+            'sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="latin-1"); '
+            'fluentpy.module._main(["fluentpy", "-p", "line"])'], input='\xe4\n'.encode('utf-8'), env=dict(os.environ, LANG='C.UTF-8'))
+        expect(output) == b'\xe4\n'
+    
+    def test_per_line_should_fail_quietly_when_the_reader_goes_away(self):
+        from subprocess import Popen, PIPE
+        process = Popen(['python', '-m', 'fluentpy', '-p', 'line * 100'], stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        process.stdout.close() # like `| head` after it read enough
+        stdout, stderr = process.communicate(input=b'line\n' * 100000)
+        expect(stderr) == b''
+        expect(process.returncode) == 1
+    
+    def test_should_not_import_heavy_modules_on_startup(self):
+        from subprocess import check_output
+        output = check_output(['python', '-c', 'import sys; before = set(sys.modules); import fluentpy; '
+            'print(" ".join(sorted(set(sys.modules) - before)))'])
+        imported = output.decode().split()
+        expect(imported).contains('fluentpy')
+        for module in ('typing', 're', 'pprint', 'weakref', 'asyncio', 'concurrent'):
+            expect(imported).not_contains(module)
+    
     def test_can_import_public_symbols(self):
         from fluentpy import lib,  each, _ as _f, Wrapper
         expect(lib.sys._) == sys
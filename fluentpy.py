@@ -25,21 +25,30 @@ write short fast shell filters in python.
 
     $ echo "foo\nbar\nbaz" | python3 -m fluentpy "lib.sys.stdin.readlines().map(each.call.upper()).map(print)"
 
+or, line at a time, so it also works on huge inputs
+
+    $ echo "foo\nbar\nbaz" | python3 -m fluentpy -p "line.upper()"
+
 Try to rewrite that in classical python (as a one line shell filter) and see which version spells out what happens in 
 which order more clearly.
 
 For further documentation and development see this documentation or the source at https://github.com/dwt/fluent
 """
 
+# Startup time matters for the shell filter use, so heavier modules (typing, re, pprint, weakref, asyncio, ...) 
+# are only imported where they are used. Check with `python3 fluent_benchmark.py --import-time`
+import abc
+import builtins
+import collections.abc
+import contextvars
 import functools
 import itertools
 import math
 import operator
-import re
+import os
 import sys
+import time
 import types
-import typing
-import pprint
 
 __all__ = ['wrap', '_'] # + @public
 __api__ = ['wrap'] # + @protected
@@ -47,8 +56,7 @@ __api__ = ['wrap'] # + @protected
 NUMBER_OF_NAMED_ARGUMENT_PLACEHOLDERS = 10
 # _wrapper_is_sealed = False
 
-# TODO investigate if functools.singledispatch would be a good candidate to replace / enhance this function
-def wrap(wrapped, *, previous=None, chain=None):
+def wrap(wrapped, *, previous=None, chain=None, history=None):
     """Factory method, wraps anything and returns the appropriate Wrapper subclass.
     
     This is the main entry point into the fluent wonderland. Wrap something and 
@@ -59,19 +67,14 @@ def wrap(wrapped, *, previous=None, chain=None):
         >>> import fluentpy as _
         >>> import fluentpy as _f
         >>> from fluentpy import wrap
+    
+    Which wrapper is returned is decided by the class of the wrapped object, like `isinstance()` would, see `register()`.
+    
+    `history` selects how much of the chain of wrappers is kept alive for this chain, see `history()`.
     """
     if isinstance(wrapped, Wrapper):
         return wrapped
     
-    by_type = (
-        (types.ModuleType, Module),
-        (typing.Text, Text),
-        (typing.Mapping, Mapping),
-        (typing.AbstractSet, Set),
-        (typing.Iterable, Iterable),
-        (typing.Callable, Callable),
-    )
-    
     if wrapped is None and chain is None and previous is not None:
         chain = previous.self.unwrap
     
@@ -79,11 +82,7 @@ def wrap(wrapped, *, previous=None, chain=None):
     if wrapped is None and chain is not None:
         decider = chain
     
-    for clazz, wrapper in by_type:
-        if isinstance(decider, clazz):
-            return wrapper(wrapped, previous=previous, chain=chain)
-    
-    return Wrapper(wrapped, previous=previous, chain=chain)
+    return _wrapper_class_of(decider)(wrapped, previous=previous, chain=chain, history=history)
 
 wrap.wrap = wrap._ = _ = wrap
 _wrap_alternatives = [wrap]
@@ -97,6 +96,349 @@ def protected(something, optional_name=None):
     setattr(wrap, optional_name or something.__name__, something)
     return something
 
+_history_policies = ('full', 'last', 'weak')
+_history = contextvars.ContextVar('fluentpy.history', default='full') # see history()
+
+class _RestoreHistory(object):
+
+    def __init__(self, token):
+        self.token = token
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exception_info):
+        _history.reset(self.token)
+
+@protected
+def history(policy):
+    """Select how much of the chain of wrappers is kept alive.
+    
+    Every wrapper remembers the wrapper it was created from in `.previous`. This is nice for
+    introspection, but it also keeps every intermediate result of a chain alive until the last
+    wrapper dies. With big intermediate results, that can be a lot of memory.
+    
+    'full': (the default) keep all previous wrappers
+    'last': only keep a copy of the immediately previous wrapper, without its history.
+        That's enough to chain off of methods that return None via `.self`.
+    'weak': only keep weak references to previous wrappers. Intermediate results can be garbage
+        collected as soon as nothing else references them.
+    
+    This sets the policy for all new chains of the current thread or asyncio task. The chain 
+    that starts from a wrapper keeps using the policy of that wrapper. Select the policy for a 
+    single chain with `wrap(value, history='last')`. Use the return value as a context manager
+    to restore the previous policy afterwards:
+        
+        >>> with _.history('last'):
+        >>>     _(big_list).map(...).map(...).map(...)
+    """
+    if policy not in _history_policies:
+        raise ValueError('History policy needs to be one of %r, got %r' % (_history_policies, policy))
+    return _RestoreHistory(_history.set(policy))
+
+_profile = None # see profile()
+
+@protected
+def profile(memory=True):
+    """Record every step of the chains run inside the with block, see `Profile`.
+    
+        >>> with _.profile() as profiled:
+        >>>     _(lines).map(parse).filter(_.each.valid).sum()
+        >>> print(profiled)
+    """
+    return Profile(memory=memory)
+
+@protected
+class Profile(object):
+    """Record every step of the chains run inside the with block, to find the slow one.
+    
+        >>> with _.profile() as profiled:
+        >>>     _(lines).map(parse).filter(_.each.valid).lazy().map(score).sum()
+        >>> print(profiled)
+        step                                  wall ms      %   cpu ms        in       out     memory
+        map(<function parse at 0x...>)        812.410   93.5  811.946     10000     10000    2.1 MiB
+        ...
+    
+    For every method called on a wrapper this records its name and arguments, wall and cpu time,
+    for iterables the number of elements going in and out, and with `memory=True` (the default)
+    the peak of the memory allocated while it ran, as measured by tracemalloc. Only the outermost
+    method counts as a step, methods it calls internally are part of its time.
+    
+    Steps of `lazy()` pipelines all run interleaved when their terminal method needs the result,
+    so they are listed below it with the time spent in their own iterator and the elements they 
+    produced. They have no memory of their own.
+    
+    `.records` has the results as a list of dicts with times in seconds and memory in bytes, 
+    `.json()` as json. Only steps run in the thread that entered the profile are recorded.
+    """
+    
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.records = []
+        self.wall = 0
+        self._depth = 0
+        self._thread = None
+        self._previous = None
+        self._started_tracemalloc = False
+    
+    def __enter__(self):
+        global _profile
+        import _thread
+        self._thread = _thread.get_ident()
+        if self.memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+        self._previous, _profile = _profile, self
+        self.wall = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exception_info):
+        global _profile
+        self.wall = time.perf_counter() - self.wall
+        _profile = self._previous
+        if self._started_tracemalloc:
+            import tracemalloc
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+    
+    def _is_recording(self):
+        import _thread
+        return self._depth == 0 and self._thread == _thread.get_ident()
+    
+    def step(self, name, wrapper, args, kwargs, run):
+        "Record `run()` as the step `name(*args, **kwargs)` called on `wrapper`"
+        if not self._is_recording():
+            return run()
+        
+        record = dict(step=_describe_call(name, args, kwargs), wall=None, cpu=None, 
+            elements_in=_count_elements(wrapper), elements_out=None, memory=None)
+        stages = len(self.records)
+        if self.memory:
+            import tracemalloc
+            # without reset_peak() (before python 3.9) only the memory still allocated afterwards can be measured
+            peak = hasattr(tracemalloc, 'reset_peak')
+            if peak:
+                tracemalloc.reset_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        self._depth += 1
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            result = run()
+        finally:
+            record['wall'] = time.perf_counter() - wall
+            record['cpu'] = time.process_time() - cpu
+            self._depth -= 1
+            if self.memory:
+                record['memory'] = tracemalloc.get_traced_memory()[peak] - memory
+            if len(self.records) > stages:
+                record['stages'] = self.records[stages:]
+                del self.records[stages:]
+            self.records.append(record)
+        record['elements_out'] = _count_elements(result)
+        return result
+    
+    def stages(self, steps, iterator):
+        "Wrap the iterators of a lazy pipeline to record the time spent in each of them"
+        if not self._depth <= 1 or not self._thread == __import__('_thread').get_ident():
+            return None
+        stage = _ProfiledStage(iterator, 'lazy source', None, self.records)
+        for name, step in steps:
+            stage = _ProfiledStage(step(stage), name, stage, self.records)
+        return stage
+    
+    def table(self):
+        "The records as a table for humans, with the share of the time spent in the with block"
+        lines = ['%-40s %10s %6s %10s %9s %9s %10s' % ('step', 'wall ms', '%', 'cpu ms', 'in', 'out', 'memory')]
+        def format_record(record, indent):
+            lines.append('%-40s %10.3f %6.1f %10.3f %9s %9s %10s' % (
+                (indent + record['step'])[:40], record['wall'] * 1e3, 100 * record['wall'] / (self.wall or 1), 
+                record['cpu'] * 1e3, _format_optional(record['elements_in']), _format_optional(record['elements_out']),
+                _format_optional(record['memory'], _format_bytes),
+            ))
+            for stage in record.get('stages', ()):
+                format_record(stage, indent + '  ')
+        for record in self.records:
+            format_record(record, '')
+        return '\n'.join(lines)
+    
+    __str__ = table
+    
+    def json(self, **kwargs):
+        "The records as json, arguments are passed to json.dumps()"
+        import json
+        return json.dumps(dict(wall=self.wall, records=self.records), **kwargs)
+
+class _ProfiledStage(object):
+    "Iterator of one stage of a lazy pipeline, times it without the time spent in the stages before it"
+    
+    def __init__(self, iterator, name, upstream, records):
+        self.iterator = iter(iterator)
+        self.upstream = upstream
+        self.inclusive_wall = self.inclusive_cpu = 0
+        self.record = dict(step=name, wall=0, cpu=0, elements_in=None if upstream is None else 0, 
+            elements_out=0, memory=None)
+        records.append(self.record)
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            element = next(self.iterator)
+        finally:
+            self.inclusive_wall += time.perf_counter() - wall
+            self.inclusive_cpu += time.process_time() - cpu
+            self.record['wall'] = self.inclusive_wall
+            self.record['cpu'] = self.inclusive_cpu
+            if self.upstream is not None:
+                self.record['wall'] -= self.upstream.inclusive_wall
+                self.record['cpu'] -= self.upstream.inclusive_cpu
+                self.record['elements_in'] = self.upstream.record['elements_out']
+        self.record['elements_out'] += 1
+        return element
+
+def _step_name(function):
+    return getattr(function, '__name__', type(function).__name__)
+
+def _describe_call(name, args, kwargs):
+    import reprlib
+    arguments = [reprlib.repr(argument) for argument in args]
+    arguments += ['%s=%s' % (key, reprlib.repr(value)) for key, value in kwargs.items()]
+    return '%s(%s)' % (name, ', '.join(arguments))
+
+def _count_elements(wrapper):
+    "Number of elements in wrapped iterables that know their length, without consuming anything"
+    if not isinstance(wrapper, Iterable) or isinstance(wrapper, Lazy):
+        return None
+    value = wrapper.unwrap
+    if isinstance(value, (str, bytes, bytearray)) or not isinstance(value, collections.abc.Sized):
+        return None
+    return len(value)
+
+def _format_optional(value, format=str):
+    return '' if value is None else format(value)
+
+def _format_bytes(count):
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(count) < 1024:
+            return '%.0f %s' % (count, unit) if unit == 'B' else '%.1f %s' % (count, unit)
+        count /= 1024
+    return '%.1f GiB' % count
+
+# (type, wrapper class) pairs, first match wins. Filled with the builtin wrappers once they are defined.
+_wrapper_types = []
+# Remembers which wrapper class to use for a type, so the (slow) isinstance checks against
+# the abstract base classes in _wrapper_types only happen once per type.
+_wrapper_cache = {}
+_wrapper_cache_token = None
+_wrapper_registrations = 0 # changes whenever register() is called
+_MAXIMUM_WRAPPER_CACHE_SIZE = 1024 # don't keep too many dynamically created classes alive
+
+def _wrapper_class_for(a_type):
+    global _wrapper_cache_token
+    # Registering a class with an abc can change the result for types we have already seen
+    token = abc.get_cache_token()
+    if token != _wrapper_cache_token:
+        _wrapper_cache.clear()
+        _wrapper_cache_token = token
+    
+    try:
+        return _wrapper_cache[a_type]
+    except KeyError:
+        pass
+    
+    wrapper = Wrapper
+    for clazz, candidate in _wrapper_types:
+        if issubclass(a_type, clazz):
+            wrapper = candidate
+            break
+    
+    if len(_wrapper_cache) >= _MAXIMUM_WRAPPER_CACHE_SIZE:
+        _wrapper_cache.clear()
+    _wrapper_cache[a_type] = wrapper
+    return wrapper
+
+def _wrapper_class_of(obj):
+    "Wrapper class for obj, decided like `isinstance()`, which also checks a `__class__` that differs from the type"
+    a_type = type(obj)
+    if obj.__class__ is a_type:
+        return _wrapper_class_for(a_type)
+    # proxies and mocks, rare enough to skip the cache
+    for clazz, candidate in _wrapper_types:
+        if isinstance(obj, clazz):
+            return candidate
+    return Wrapper
+
+@protected
+def register(for_type, wrapper_class=None):
+    """Make `wrap()` use `wrapper_class` for all instances of `for_type`.
+    
+    `for_type` can be any class or abstract base class. Later registrations take precedence over
+    earlier ones and over the builtin wrappers of this library, so you can also use this to
+    specialize those. Works as a decorator, much like `functools.singledispatch().register()`:
+        
+        >>> @_.register(decimal.Decimal)
+        >>> class Decimal(_.Wrapper):
+        >>>     def double(self): return self * 2
+        >>> _(decimal.Decimal(3)).double()._ == decimal.Decimal(6)
+    
+    The decision which wrapper to use is cached per type, so registering more wrappers
+    doesn't make `wrap()` slower.
+    """
+    if wrapper_class is None:
+        return functools.partial(register, for_type)
+    
+    global _wrapper_registrations
+    assert issubclass(wrapper_class, Wrapper), 'Can only register subclasses of Wrapper, got %r' % (wrapper_class,)
+    _wrapper_types.insert(0, (for_type, wrapper_class))
+    _wrapper_cache.clear()
+    _wrapper_registrations += 1
+    return wrapper_class
+
+def _unregister(for_type, wrapper_class):
+    "Undo `register(for_type, wrapper_class)`"
+    global _wrapper_registrations
+    _wrapper_types.remove((for_type, wrapper_class))
+    _wrapper_cache.clear()
+    _wrapper_registrations += 1
+
+def _compile_each_arguments(args, kwargs):
+    "Replace each expressions with their compiled function, so they are as cheap to call as a lambda"
+    for argument in args:
+        if isinstance(argument, EachExpression):
+            args = tuple(argument._function if isinstance(argument, EachExpression) else argument for argument in args)
+            break
+    for key, value in kwargs.items():
+        if isinstance(value, EachExpression):
+            kwargs[key] = value._function
+    return args, kwargs
+
+def _result_wrapper():
+    """Like `wrap(result, previous=previous)`, but for the results of one method.
+    
+    Most methods always return the same type, so the wrapper class for the type of 
+    the last result is remembered, which skips the type dispatch of `wrap()`.
+    """
+    # result type, wrapper class, abc cache token, registrations
+    # replaced as a whole, so concurrent calls always see a consistent one
+    learned = (None, None, None, None)
+    def wrap_result(result, previous):
+        nonlocal learned
+        result_type = type(result)
+        learned_type, wrapper_class, token, registrations = learned
+        if result_type is learned_type and token == abc.get_cache_token() and registrations == _wrapper_registrations:
+            return wrapper_class(result, previous=previous, chain=None)
+        if result is None or isinstance(result, Wrapper) or result.__class__ is not result_type:
+            return wrap(result, previous=previous)
+        
+        wrapper_class = _wrapper_class_for(result_type)
+        learned = result_type, wrapper_class, abc.get_cache_token(), _wrapper_registrations
+        return wrapper_class(result, previous=previous, chain=None)
+    return wrap_result
+
 # REFACT consider if this can be achieved with Callable
 def wrapped(wrapped_function, additional_result_wrapper=None, self_index=0):
     """
@@ -105,12 +447,45 @@ def wrapped(wrapped_function, additional_result_wrapper=None, self_index=0):
     
     Also perfect to adapt free functions as instance methods.
     """
+    if callable(additional_result_wrapper):
+        def call(self, *args, **kwargs):
+            args, kwargs = _compile_each_arguments(args, kwargs)
+            return additional_result_wrapper(wrapped_function(*args[0:self_index], self.unwrap, *args[self_index:], **kwargs))
+        return _wrap_results_of(call, wrapped_function)
+    
+    wrap_result = _result_wrapper()
+    name = _step_name(wrapped_function)
+    if self_index == 0:
+        def call(self, *args, **kwargs):
+            args, kwargs = _compile_each_arguments(args, kwargs)
+            return wrapped_function(self.unwrap, *args, **kwargs)
+        def wrapper(self, *args, **kwargs):
+            if _profile is not None:
+                return _profile.step(name, self, args, kwargs, lambda: wrap_result(call(self, *args, **kwargs), self))
+            args, kwargs = _compile_each_arguments(args, kwargs)
+            return wrap_result(wrapped_function(self.unwrap, *args, **kwargs), self)
+    else:
+        def call(self, *args, **kwargs):
+            args, kwargs = _compile_each_arguments(args, kwargs)
+            return wrapped_function(*args[0:self_index], self.unwrap, *args[self_index:], **kwargs)
+        def wrapper(self, *args, **kwargs):
+            if _profile is not None:
+                return _profile.step(name, self, args, kwargs, lambda: wrap_result(call(self, *args, **kwargs), self))
+            args, kwargs = _compile_each_arguments(args, kwargs)
+            return wrap_result(wrapped_function(*args[0:self_index], self.unwrap, *args[self_index:], **kwargs), self)
+    wrapper = functools.wraps(wrapped_function)(wrapper)
+    wrapper._call_without_wrapping = call # see tupleize()
+    return wrapper
+
+def _wrap_results_of(call, wrapped_function):
+    wrap_result = _result_wrapper()
+    name = _step_name(wrapped_function)
     @functools.wraps(wrapped_function)
     def wrapper(self, *args, **kwargs):
-        result = wrapped_function(*args[0:self_index], self.unwrap, *args[self_index:], **kwargs)
-        if callable(additional_result_wrapper):
-            result = additional_result_wrapper(result)
-        return wrap(result, previous=self)
+        if _profile is not None:
+            return _profile.step(name, self, args, kwargs, lambda: wrap_result(call(self, *args, **kwargs), self))
+        return wrap_result(call(self, *args, **kwargs), self)
+    wrapper._call_without_wrapping = call
     return wrapper
 
 # REFACT consider if this can be achieved with Callable
@@ -141,11 +516,24 @@ def tupleize(wrapped_function):
     
     Especially usefull to de-iterate methods / function
     """
+    # Methods made with wrapped() can skip wrapping the iterator that is consumed right away
+    call = getattr(wrapped_function, '_call_without_wrapping', wrapped_function)
+    wrap_result = _result_wrapper()
+    name = _step_name(wrapped_function)
     @functools.wraps(wrapped_function)
     def wrapper(self, *args, **kwargs):
-        return wrap(tuple(wrapped_function(self, *args, **kwargs)), previous=self)
+        if _profile is not None:
+            return _profile.step(_tupleized_step_name(self, name, wrapper), self, args, kwargs, 
+                lambda: wrap_result(tuple(call(self, *args, **kwargs)), self))
+        return wrap_result(tuple(call(self, *args, **kwargs)), self)
     return wrapper
 
+def _tupleized_step_name(wrapper, name, method):
+    "Like the lazy steps, `sorted = tupleize(isorted)` is profiled as sorted(), but only if that is where it lives"
+    if name.startswith('i') and getattr(type(wrapper), name[1:], None) is method:
+        return name[1:]
+    return name
+
 
 @protected
 class Wrapper(object):
@@ -169,13 +557,39 @@ class Wrapper(object):
        string interface, etc.
     """
     
-    __slots__ = ['__wrapped', '__previous', '__chain']
+    __slots__ = ['__wrapped', '__previous', '__chain', '__history', '__weakref__']
     
-    def __init__(self, wrapped, *, previous, chain):
+    # Callables need their previous wrapper to chain off of methods that return None
+    _needs_previous = False
+    
+    def __init__(self, wrapped, *, previous, chain, history=None):
         assert wrapped is not None or chain is not None, 'Cannot chain off of None'
         self.__wrapped = wrapped
-        self.__previous = previous
         self.__chain = chain # REFACT consider rename to __self?
+        if history is None:
+            history = _history.get() if previous is None else previous.__history
+        self.__history = history
+        
+        if previous is None or history == 'full':
+            self.__previous = previous
+        elif history == 'weak' and not self._needs_previous:
+            import weakref
+            self.__previous = weakref.ref(previous)
+        else:
+            self.__previous = previous._without_history()
+    
+    def _without_history(self):
+        "Copy of this wrapper that doesn't keep its previous wrappers alive"
+        if self.__previous is None:
+            return self
+        clone = object.__new__(type(self))
+        clone.__wrapped = self.__wrapped
+        clone.__chain = self.__chain
+        clone.__history = self.__history
+        clone.__previous = None
+        if type(self).__dictoffset__:
+            clone.__dict__.update(self.__dict__)
+        return clone
     
     def __str__(self):
         return "fluentpy.wrap(%s)" % (self.unwrap,)
@@ -183,6 +597,10 @@ class Wrapper(object):
     def __repr__(self):
         return "fluentpy.wrap(%r)" % (self.unwrap,)
     
+    def __reduce__(self):
+        "Wrappers are pickled as `wrap(value)`, without their previous wrappers"
+        return wrap, (self.unwrap,)
+    
     # Proxied methods
     
     # for name in dir(operator):
@@ -216,8 +634,13 @@ class Wrapper(object):
         
         This allows you to walk the chain of wrappers that where created in your expression. 
         Mainly used internally but might be usefull for introspection.
+        
+        How far back this goes depends on the history policy, see `history()`.
         """
-        return self.__previous
+        previous = self.__previous
+        if self.__history == 'weak' and previous is not None and not self._needs_previous:
+            return previous()
+        return previous
     
     @property
     def self(self):
@@ -283,7 +706,10 @@ class Wrapper(object):
     dir = wrapped(dir)
     vars = wrapped(vars)
     print = wrapped(print)
-    pprint = wrapped(pprint.pprint)
+    @wrapped
+    def pprint(self, *args, **kwargs):
+        import pprint
+        return pprint.pprint(self, *args, **kwargs)
     help = wrapped(help)
     type = unwrapped(type)
 
@@ -312,18 +738,37 @@ class Module(Wrapper):
     All objects returned from lib are pre-wrapped, so you can chain off of them immediately.
     """
     
+    def __init__(self, wrapped, *, previous, chain, history=None):
+        super().__init__(wrapped, previous=previous, chain=chain, history=history)
+        self._attributes = dict() # name -> (value, wrapped value)
+    
     def __getattr__(self, name):
-        if hasattr(self.unwrap, name):
-            return wrap(getattr(self.unwrap, name))
+        # Resolved attributes are cached as long as they are still the same object
+        if name == '_attributes':
+            raise AttributeError(name)
+        cached = self._attributes.get(name)
+        if cached is not None and self._current(self.unwrap, name) is cached[0]:
+            return cached[1]
         
-        import importlib
-        module = None
-        if self.unwrap is virtual_root_module:
-            module = importlib.import_module(name)
+        value, wrapper = self._resolve(name)
+        self._attributes[name] = (value, wrapper)
+        return wrapper
+    
+    def _current(self, module, name):
+        "What `name` refers to right now in `module`, without importing anything"
+        if module is virtual_root_module:
+            return sys.modules.get(name, _missing)
+        return getattr(module, name, _missing)
+    
+    def _resolve(self, name):
+        "Look up or import `name`, returns the value and its wrapper"
+        if hasattr(self.unwrap, name):
+            value = getattr(self.unwrap, name)
+        elif self.unwrap is virtual_root_module:
+            value = _import(name)
         else:
-            module = importlib.import_module('.'.join((self.unwrap.__name__, name)))
-        
-        return wrap(module)
+            value = _import('.'.join((self.unwrap.__name__, name)))
+        return value, wrap(value)
     
     @wrapped
     def reload(self):
@@ -336,12 +781,295 @@ lib = Module(virtual_root_module, previous=None, chain=None)
 lib.__name__ = 'lib'
 public(lib)
 
+@protected
+class LazyModule(Module):
+    """Like `lib`, but modules are only imported once they are actually used.
+    
+    >>> numpy = _.lazy_lib.numpy # doesn't import numpy yet
+    >>> numpy.array([1, 2, 3]) # but this does
+    
+    This uses `importlib.util.LazyLoader`, so the module is imported on the first 
+    attribute access. Parent packages of submodules still have to be imported right away, 
+    that is how python finds submodules.
+    """
+    
+    def __init__(self, wrapped, *, previous, chain, history=None, name=None, is_package=True):
+        super().__init__(wrapped, previous=previous, chain=chain, history=history)
+        self._name = name
+        self._is_package = is_package
+    
+    def _full_name(self, name):
+        return name if self._name is None else '.'.join((self._name, name))
+    
+    def _current(self, module, name):
+        if self._is_package and self._full_name(name) in sys.modules:
+            return sys.modules[self._full_name(name)]
+        return super()._current(module, name)
+    
+    def _load_attribute(self, name):
+        "Get an attribute of the module, which imports it if that didn't happen yet"
+        if self._name not in _import_timings and type(self.unwrap) is not types.ModuleType:
+            value = _timed(self._name, getattr, self.unwrap, name)
+        else:
+            value = getattr(self.unwrap, name)
+        return value, wrap(value)
+    
+    def _resolve(self, name):
+        full_name = self._full_name(name)
+        if not self._is_package:
+            return self._load_attribute(name) # not a package, so this is a real use of the module
+        
+        import importlib.util
+        module = sys.modules.get(full_name)
+        if module is not None:
+            is_package = type(module) is not types.ModuleType or hasattr(module, '__path__')
+            return module, LazyModule(module, previous=None, chain=None, name=full_name, is_package=is_package)
+        
+        if self._name is not None:
+            self._load_attribute('__path__') # finding submodules imports the package anyway
+        try:
+            spec = importlib.util.find_spec(full_name)
+        except ModuleNotFoundError:
+            if self._name is None:
+                raise
+            spec = None # the parent is not a package after all
+        if spec is None:
+            if self._name is None:
+                return super()._resolve(name) # raises a nice ModuleNotFoundError
+            return self._load_attribute(name)
+        if spec.loader is None or not hasattr(spec.loader, 'exec_module'):
+            return super()._resolve(name) # namespace packages and old loaders can't be lazy
+        
+        spec.loader = importlib.util.LazyLoader(spec.loader)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[full_name] = module
+        spec.loader.exec_module(module)
+        if self._name is not None:
+            setattr(self.unwrap, name, module)
+        is_package = spec.submodule_search_locations is not None
+        return module, LazyModule(module, previous=None, chain=None, name=full_name, is_package=is_package)
+
+lazy_lib = LazyModule(virtual_root_module, previous=None, chain=None)
+lazy_lib.__name__ = 'lazy_lib'
+protected(lazy_lib)
+
+_import_timings = dict() # module name -> seconds
+
+def _timed(name, function, *args):
+    "Call function and record how long it took as the import time of module `name`"
+    start = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        _import_timings[name] = time.perf_counter() - start
+
+def _import(name):
+    import importlib
+    if name in sys.modules:
+        return importlib.import_module(name)
+    return _timed(name, importlib.import_module, name)
+
+@protected
+def import_timings():
+    """How long the imports done through `lib` and `lazy_lib` took in seconds, slowest first.
+    
+    >>> _.import_timings().map(print)
+    ('numpy', 0.0873)
+    ('json', 0.0012)
+    
+    Imports of lazy modules are timed when they actually happen. 
+    Like with `python -X importtime` the time includes the imports done by the module itself.
+    """
+    return wrap(tuple(sorted(_import_timings.items(), key=operator.itemgetter(1), reverse=True)))
+
+def _curry_layout(args_and_placeholders):
+    """Resolve the placeholders given to `Callable.curry()` to argument positions.
+    
+    Returns a tuple of ('constant', value), ('argument', index) and ('arguments', start_index) 
+    where the latter stands for `*args[start_index:]`.
+    """
+    placeholders = tuple(_wrap_alternatives)
+    reordering_placeholders = tuple(getattr(wrap, '_%i' % index) for index in range(NUMBER_OF_NAMED_ARGUMENT_PLACEHOLDERS))
+    def is_placeholder(needle, haystack):
+        return any(map(lambda each: each is needle, haystack))
+    
+    layout = []
+    placeholder_index = -1
+    for index, arg_or_placeholder in enumerate(args_and_placeholders):
+        if is_placeholder(arg_or_placeholder, placeholders):
+            placeholder_index += 1
+            layout.append(('argument', placeholder_index))
+        elif is_placeholder(arg_or_placeholder, reordering_placeholders):
+            placeholder_index += 1
+            layout.append(('argument', arg_or_placeholder.unwrap))
+        elif arg_or_placeholder is wrap._args:
+            placeholder_index += 1
+            assert index + 1 == len(args_and_placeholders), \
+                'Variable arguments placeholder <_args> needs to be last'
+            layout.append(('arguments', placeholder_index))
+        else: # real argument
+            layout.append(('constant', arg_or_placeholder))
+    return tuple(layout)
+
+def _not_enough_curried_arguments(required_arguments, args):
+    raise AssertionError('Not enough arguments given to curried function. Need at least %i, got %i: %r'
+        % (required_arguments, len(args), args))
+
+def _compile_curried(function, layout, default_kwargs):
+    """Generate a function that assembles the arguments according to `layout` and calls `function`.
+    
+    Positional arguments are taken as named parameters, so a call costs about as much as a lambda.
+    """
+    required_arguments = 1 + max((value for kind, value in layout if kind == 'argument'), default=-1)
+    parameters = ['_argument%i' % index for index in range(required_arguments)]
+    names, values = ['function', 'defaults', '_missing', '_not_enough_curried_arguments'], \
+        [function, default_kwargs, _missing, _not_enough_curried_arguments]
+    arguments = []
+    for kind, value in layout:
+        if kind == 'constant':
+            names.append('_constant%i' % len(names))
+            values.append(value)
+            arguments.append(names[-1])
+        elif kind == 'argument':
+            arguments.append(parameters[value])
+        else:
+            arguments.extend(parameters[value:])
+            arguments.append('*args[%i:]' % (value - required_arguments) if value > required_arguments else '*args')
+    
+    source = ['def closure(%s):' % ', '.join(names)]
+    source.append('    def curried(%s):' % ', '.join(['%s=_missing' % parameter for parameter in parameters] + ['*args', '**kwargs']))
+    if required_arguments:
+        source.append('        if %s is _missing:' % parameters[-1])
+        source.append('            _not_enough_curried_arguments(%i, tuple(argument for argument in (%s) if argument is not _missing))'
+            % (required_arguments, ''.join(parameter + ', ' for parameter in parameters)))
+    source.append('        if kwargs:')
+    source.append('            return function(%s)' % ', '.join(arguments + ['**dict(defaults, **kwargs)']))
+    source.append('        return function(%s)' % ', '.join(arguments + (['**defaults'] if default_kwargs else [])))
+    source.append('    return curried')
+    namespace = dict()
+    exec('\n'.join(source), namespace)
+    curried = namespace['closure'](*values)
+    curried.__name__ = curried.__qualname__ = 'curried_%s' % getattr(function, '__name__', 'function')
+    return curried
+
+_missing = object()
+
+@protected
+class Curried(functools.partial):
+    """The function returned from `Callable.curry()`.
+    
+    The placeholders are resolved when currying and a function is generated that 
+    just puts the arguments in their place, so calling a curried function costs about 
+    as much as calling an equivalent lambda. Curried functions can be pickled 
+    (as long as the function and the arguments can be).
+    """
+    
+    def __new__(cls, function, layout, default_kwargs):
+        kinds = tuple(kind for kind, value in layout)
+        if kinds and kinds[-1] == 'arguments' and set(kinds[:-1]) <= {'constant'}:
+            # `_args` fast path, functools.partial can do this without calling python code at all
+            self = super().__new__(cls, function, *(value for kind, value in layout[:-1]), **default_kwargs)
+        else:
+            self = super().__new__(cls, _compile_curried(function, layout, default_kwargs))
+        self.function = function
+        self.layout = layout
+        self.default_kwargs = default_kwargs
+        return self
+    
+    def __repr__(self):
+        arguments = []
+        for kind, value in self.layout:
+            if kind == 'constant':
+                arguments.append(repr(value))
+            elif kind == 'argument':
+                arguments.append('_._%i' % value)
+            else:
+                arguments.append('_._args')
+        arguments.extend('%s=%r' % item for item in self.default_kwargs.items())
+        return 'fluentpy.wrap(%r).curry(%s)' % (self.function, ', '.join(arguments))
+    
+    def __reduce__(self):
+        def picklable(value):
+            # each expressions are compiled when given to wrapped methods
+            tree = getattr(value, '_each_tree', None)
+            return value if tree is None else EachExpression(tree)
+        layout = tuple((kind, picklable(value) if kind == 'constant' else value) for kind, value in self.layout)
+        default_kwargs = {key: picklable(value) for key, value in self.default_kwargs.items()}
+        return Curried, (self.function, layout, default_kwargs)
+
+## Vectorization ......................................................................
+
+def _numpy(required=False):
+    "numpy if it is installed. Only imported when needed, as it is a heavy and optional dependency."
+    if not required and 'numpy' not in sys.modules:
+        return None
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        if required:
+            raise
+        return None
+
+def _is_numpy_ufunc(function):
+    numpy = _numpy()
+    return numpy is not None and isinstance(function, numpy.ufunc)
+
+def _is_broadcastable(value):
+    return isinstance(value, collections.abc.Sequence) and not isinstance(value, (str, bytes, bytearray))
+
+def _broadcast_dimensions(value):
+    dimensions = 0
+    while _is_broadcastable(value):
+        dimensions += 1
+        if 0 == len(value):
+            break
+        value = value[0]
+    return dimensions
+
+def _broadcast(function, args, dimensions, kwargs):
+    """Pure python broadcasting with the same rules as numpy.
+    
+    Dimensions are aligned from the right, missing and length one dimensions are repeated.
+    """
+    maximum_dimension = max(dimensions, default=0)
+    if 0 == maximum_dimension:
+        return function(*args, **kwargs)
+    
+    lengths = set(len(arg) for arg, dimension in zip(args, dimensions) if dimension == maximum_dimension)
+    lengths.discard(1)
+    if len(lengths) > 1:
+        raise ValueError('Arguments could not be broadcast together, got lengths %r' % sorted(lengths))
+    length = lengths.pop() if lengths else 1
+    
+    iterables = []
+    for arg, dimension in zip(args, dimensions):
+        if dimension < maximum_dimension:
+            iterables.append(itertools.repeat(arg, length))
+        elif 1 == len(arg):
+            iterables.append(itertools.repeat(arg[0], length))
+        else:
+            iterables.append(arg)
+    next_dimensions = tuple(
+        dimension - 1 if dimension == maximum_dimension else dimension
+        for dimension in dimensions
+    )
+    return tuple(_broadcast(function, row, next_dimensions, kwargs) for row in zip(*iterables))
+
 @protected
 class Callable(Wrapper):
     """Higher order methods for callables."""
     
+    _needs_previous = True
+    
     def __call__(self, *args, **kwargs):
         """"Call through to the wrapped function."""
+        if _profile is not None:
+            return _profile.step(_step_name(self.unwrap), self, args, kwargs, 
+                lambda: Callable._call(self, args, kwargs))
+        return Callable._call(self, args, kwargs)
+    
+    def _call(self, args, kwargs):
         def unwrap_if_neccessary(something):
             if isinstance(something, Wrapper):
                 return something.unwrap
@@ -354,8 +1082,7 @@ class Callable(Wrapper):
         chain = None if self.previous is None else self.previous
         return wrap(result, previous=self, chain=chain)
     
-    @wrapped
-    def curry(self, *args_and_placeholders, **default_kwargs):
+    def curry(self, *args_and_placeholders, unwrap=False, **default_kwargs):
         """"Like functools.partial, but with a twist.
         
         If you use `wrap` or `_` as a positional argument, upon the actual call, 
@@ -377,46 +1104,76 @@ class Callable(Wrapper):
         (Note that it is only supported in the last position of the positional argument list.)
         
         >>> _(operator.add).curry(_.args)('foo', 'bar)._ == 'foobar'
+        
+        The placeholders are only resolved once, so the curried function is about as fast as 
+        a lambda. Calling it through the wrapper still wraps every result though, 
+        so use `unwrap=True` to get the plain function if it is called a lot, e.g. in `.map()`.
+        
+        >>> _(range(10**6)).map(_(operator.add).curry(_, 3, unwrap=True))
+        """
+        args_and_placeholders, default_kwargs = _compile_each_arguments(args_and_placeholders, default_kwargs)
+        curried = Curried(self.unwrap, _curry_layout(args_and_placeholders), default_kwargs)
+        if unwrap:
+            return curried
+        return wrap(curried, previous=self)
+    
+    @wrapped
+    def vectorize(self, *args_and_placeholders, signature=None, otypes=None, **default_kwargs):
+        """Apply a function on scalars element wise over sequences and arrays, like numpy.vectorize.
+        
+        >>> _(operator.add).vectorize()([1, 2], 10)._ == (11, 12)
+        >>> _(operator.add).vectorize()([1, 2], [[10], [20]])._ == ((11, 12), (21, 22))
+        
+        Broadcasting follows the numpy rules: dimensions are aligned from the right and 
+        dimensions of length one are repeated. Strings and bytes count as scalars.
+        
+        Placeholders work just like in `curry()`. Only the arguments that end up 
+        in placeholder positions are broadcast, everything else is passed through as is.
+        
+        >>> _(operator.contains).vectorize([1, 2], _)([1, 3])._ == (True, False)
+        
+        Without numpy, or if none of the arguments is a numpy array, the result is a tuple 
+        (of tuples, depending on the dimensions). 
+        If any argument is a numpy array, numpy does the broadcasting: ufuncs are called directly, 
+        other functions go through `numpy.frompyfunc()` and the result is an array 
+        with the type of the first result (or `otypes`).
+        
+        `signature` (and `otypes`) are passed on to `numpy.vectorize()` and thus require numpy.
         """
-        placeholders = tuple(_wrap_alternatives)
-        splat_args_placeholder = wrap._args
-        reordering_placeholders = tuple(getattr(wrap, '_%i' % index) for index in range(NUMBER_OF_NAMED_ARGUMENT_PLACEHOLDERS))
-        all_placeholders = placeholders + (splat_args_placeholder,) + reordering_placeholders
-        def merge_args(args_and_placeholders, args):
-            def assert_enough_args(required_number):
-                assert len(args) > required_number, \
-                    'Not enough arguments given to curried function. Need at least %i, got %i: %r' \
-                        % (placeholder_index, len(args), args)
+        function = self
+        if args_and_placeholders:
+            function = Curried(self, _curry_layout(args_and_placeholders), {})
+        
+        if signature is not None:
+            vectorized = _numpy(required=True).vectorize(function, signature=signature, otypes=otypes)
+            return functools.partial(vectorized, **default_kwargs) if default_kwargs else vectorized
+        
+        is_ufunc = _is_numpy_ufunc(self) and not args_and_placeholders
+        numpy_functions = {}
+        def vectorized(*args, **kwargs):
+            kwargs = dict(default_kwargs, **kwargs)
+            numpy = _numpy()
+            if numpy is None or not any(isinstance(arg, numpy.ndarray) for arg in args):
+                return _broadcast(function, args, tuple(map(_broadcast_dimensions, args)), kwargs)
+            
+            if is_ufunc:
+                return function(*args, **kwargs)
             
-            def is_placeholder(needle, haystack):
-                return any(map(lambda each: each is needle, haystack))
-                
-            new_arguments = list()
-            placeholder_index = -1
-            for index, arg_or_placeholder in enumerate(args_and_placeholders):
-                if is_placeholder(arg_or_placeholder, all_placeholders):
-                    placeholder_index += 1
-                if is_placeholder(arg_or_placeholder, placeholders):
-                    assert_enough_args(placeholder_index)
-                    new_arguments.append(args[placeholder_index])
-                elif is_placeholder(arg_or_placeholder, reordering_placeholders):
-                    assert_enough_args(arg_or_placeholder.unwrap)
-                    new_arguments.append(args[arg_or_placeholder.unwrap])
-                elif is_placeholder(arg_or_placeholder, [splat_args_placeholder]):
-                    assert index + 1 == len(args_and_placeholders), \
-                        'Variable arguments placeholder <_args> needs to be last'
-                    new_arguments.extend(args[placeholder_index:])
-                else: # real argument
-                    new_arguments.append(arg_or_placeholder)
-            return new_arguments
-        
-        # @functools.wraps(self)
-        def wrapper(*actual_args, **actual_kwargs):
-            return self(
-                *merge_args(args_and_placeholders, actual_args),
-                **dict(default_kwargs, **actual_kwargs)
-            )
-        return wrap(wrapper, previous=self)
+            if kwargs:
+                numpy_function = numpy.frompyfunc(functools.partial(function, **kwargs), len(args), 1)
+            else:
+                if len(args) not in numpy_functions:
+                    numpy_functions[len(args)] = numpy.frompyfunc(function, len(args), 1)
+                numpy_function = numpy_functions[len(args)]
+            result = numpy_function(*args)
+            if not isinstance(result, numpy.ndarray):
+                return result
+            if otypes:
+                return result.astype(otypes[0])
+            if 0 == result.size:
+                return result
+            return result.astype(numpy.asarray(result.flat[0]).dtype)
+        return vectorized
     
     @wrapped
     def compose(self, outer):
@@ -472,7 +1229,7 @@ class Iterable(Wrapper):
     @wrapped
     def get(self, index, default=get_default_marker):
         # Not sure this is the best way to support iterators - but there is no clear way in which we can retain the generator 
-        if not isinstance(self, typing.Sized):
+        if not isinstance(self, collections.abc.Sized):
             # This is very suboptimal, as it consumes the generator till the asked for index. Still, I don't want this to crash on infinite iterators by just doing tuple(self)
             for i, element in enumerate(self):
                 if index == i:
@@ -529,9 +1286,139 @@ class Iterable(Wrapper):
     ireversed = wrapped(reversed)
     reversed = tupleize(ireversed)
     
-    isorted = wrapped(sorted)
+    @wrapped
+    def isorted(self, key=None, reverse=False, run_size=None):
+        """Like the builtin sorted, but with `run_size` data that doesn't fit into memory can be sorted too.
+        
+        Then at most `run_size` elements are sorted in memory at a time. If there are more, each 
+        sorted run is pickled to a temporary file and the runs are merged with `heapq.merge()` 
+        while iterating the result, which only needs a small batch of each run in memory.
+        The sort is stable either way.
+        
+        >>> _(open('huge.csv')).lazy().map(parse).sorted(key=_.each.date, run_size=10**6).map(write)
+        
+        If only the first few are needed, `nsmallest()` and `nlargest()` are faster.
+        """
+        if run_size is None:
+            return sorted(self, key=key, reverse=reverse)
+        return _external_sorted(self, key, reverse, run_size)
     sorted = tupleize(isorted)
     
+    @wrapped
+    def iunique(self, key=None, approx=False, capacity=None, error_rate=0.001):
+        """Drop elements (or elements with keys) that were seen before, keeps the order of first appearance.
+        
+        >>> _(events).unique(key=_.each.id)
+        
+        This remembers every key in a set. With `approx=True` a `BloomFilter` for `capacity` keys 
+        is used instead, which needs about 1.8 bytes per key for the default `error_rate` 
+        (regardless of the size of the keys). The price is that about that fraction of the 
+        unique elements is dropped as if it was seen before, and it is quite a bit slower than the set.
+        """
+        if approx:
+            if capacity is None:
+                raise ValueError('unique(approx=True) needs the expected number of unique keys as capacity')
+            seen = BloomFilter(capacity, error_rate)
+            for element in self:
+                if not seen.add(element if key is None else key(element)):
+                    yield element
+            return
+        
+        seen = set()
+        remember = seen.add
+        if key is None:
+            for element in self:
+                if element not in seen:
+                    remember(element)
+                    yield element
+        else:
+            for element in self:
+                element_key = key(element)
+                if element_key not in seen:
+                    remember(element_key)
+                    yield element
+    unique = tupleize(iunique)
+    
+    @wrapped
+    def ijoin_on(self, other, left_key, right_key=None, how='inner'):
+        """Relational join of self with other, yields `(left, right)` pairs of elements with equal keys.
+        
+        >>> _(orders).join_on(customers, _.each.customer_id, _.each.id, how='left')
+        
+        `right_key` defaults to `left_key`. With `how='left'`, `'right'` or `'outer'`, elements 
+        without a match on the other side are paired with None.
+        
+        The elements of one side are put into a dict by key, the other side is streamed. 
+        That is other, unless both sides know their length and self is shorter. Pairs come
+        in the order of the streamed side, unmatched elements of the indexed side at the end.
+        For inputs that are sorted by key, `merge_join()` needs no index.
+        """
+        _check_join_how(how)
+        right_key = right_key or left_key
+        if isinstance(self, collections.abc.Sized) and isinstance(other, collections.abc.Sized) and len(self) < len(other):
+            pairs = _hash_join(other, right_key, self, left_key, how in ('right', 'outer'), how in ('left', 'outer'))
+            return ((left, right) for right, left in pairs)
+        return _hash_join(self, left_key, other, right_key, how in ('left', 'outer'), how in ('right', 'outer'))
+    join_on = tupleize(ijoin_on)
+    
+    @wrapped
+    def imerge_join(self, other, left_key, right_key=None, how='inner'):
+        """Like `join_on()`, but for self and other sorted (ascending) by key.
+        
+        Reads both sides in lockstep, so only the elements of other with the current key 
+        are kept in memory. Pairs come in the order of the keys.
+        """
+        _check_join_how(how)
+        return _merge_join(self, left_key, other, right_key or left_key, how in ('left', 'outer'), how in ('right', 'outer'))
+    merge_join = tupleize(imerge_join)
+    
+    @wrapped
+    def nsmallest(self, n, key=None):
+        "The `n` smallest elements, in order. With a heap of `n` elements, instead of sorting everything."
+        import heapq
+        return tuple(heapq.nsmallest(n, self, key=key))
+    
+    @wrapped
+    def nlargest(self, n, key=None):
+        "The `n` largest elements, largest first. With a heap of `n` elements, instead of sorting everything."
+        import heapq
+        return tuple(heapq.nlargest(n, self, key=key))
+    top_k = nlargest
+    
+    @wrapped
+    def approx_distinct(self, precision=14):
+        """Estimate the number of distinct elements in one pass, with a `HyperLogLog` of 2**`precision` bytes.
+        
+        >>> _(requests).map(_.each.ip).approx_distinct().estimate()
+        
+        The standard error is about 1.04 / sqrt(2**precision), 0.8% for the default.
+        Returns the sketch, so sketches of several shards can be combined with `|`.
+        """
+        return HyperLogLog(precision).update(self)
+    
+    @wrapped
+    def heavy_hitters(self, k):
+        """Find the frequent elements in one pass, with a `MisraGries` sketch of `k` counters.
+        
+        >>> _(requests).map(_.each.path).heavy_hitters(100).most_common(10)
+        
+        Every element that makes up more than 1/(k+1) of the input is found, counts are 
+        underestimated by at most that fraction of the input.
+        Returns the sketch, so sketches of several shards can be combined with `|`.
+        """
+        return MisraGries(k).update(self)
+    
+    @wrapped
+    def approx_quantiles(self, k=200):
+        """Summarize the distribution in one pass, with a `KLL` sketch of about 3*`k` elements.
+        
+        >>> _(requests).map(_.each.duration).approx_quantiles().quantiles(0.5, 0.9, 0.99)
+        
+        The rank error is about 1.7 / `k`, 1% for the default. The elements need to be comparable.
+        Returns the sketch, so sketches of several shards can be combined with `|`.
+        """
+        return KLL(k).update(self)
+    
     @wrapped
     def igrouped(self, group_length):
         """Cut self into tupels of length group_length
@@ -543,15 +1430,32 @@ class Iterable(Wrapper):
     zip = tupleize(izip)
     
     @wrapped
-    def iflatten(self, level=math.inf):
-        "Modeled after rubys array.flatten @see http://ruby-doc.org/core-1.9.3/Array.html#method-i-flatten"
-        for element in self:
-            if level > 0 and isinstance(element, typing.Iterable):
-                for subelement in wrap(element).iflatten(level=level-1):
-                    yield subelement
-            else:
+    def iflatten(self, level=math.inf, leaf=None):
+        """Modeled after rubys array.flatten @see http://ruby-doc.org/core-1.9.3/Array.html#method-i-flatten
+        
+        Strings, bytes and mappings are not flattened, pass a predicate as `leaf` to keep 
+        other elements whole as well.
+        
+        >>> _([1, ['foo', [2, {'a': 3}]]]).flatten()._ == (1, 'foo', 2, {'a': 3})
+        >>> _([1, [(2, 3), [4]]]).flatten(leaf=lambda each: isinstance(each, tuple))._ == (1, (2, 3), 4)
+        
+        Uses a stack of iterators instead of recursion, so any depth of nesting works.
+        """
+        nests = {} # type -> if its instances are flattened, as checks against the abcs are slow
+        stack = [iter(self)]
+        while stack:
+            for element in stack[-1]:
+                if len(stack) <= level:
+                    element_type = type(element)
+                    if element_type not in nests:
+                        nests[element_type] = isinstance(element, collections.abc.Iterable) \
+                            and not _is_flatten_leaf(element)
+                    if nests[element_type] and (leaf is None or not leaf(element)):
+                        stack.append(iter(element))
+                        break
                 yield element
-        return
+            else:
+                stack.pop()
     flatten = tupleize(iflatten)
     
     igroupby = wrapped(itertools.groupby)
@@ -562,19 +1466,104 @@ class Iterable(Wrapper):
             result.append((key, tuple(values)))
         return wrap(tuple(result), previous=self)
     
-    def tee(self, function):
-        "This override tries to retain iterators, as a speedup"
-        if hasattr(self.unwrap, '__next__'): # iterator
+    @wrapped
+    def igroup_by(self, key=None, agg='collect', value=None, max_keys=None):
+        """Group by `key` without sorting, and fold each element into the aggregate of its group right away.
+        
+        Unlike `groupby()` the input doesn't need to be sorted and only the aggregates are kept
+        in memory, one per distinct key. Yields `(key, aggregate)` pairs, in the order the keys
+        were first seen.
+        
+        `agg` is one of 'count', 'sum', 'min', 'max', 'mean', 'first', 'last' or 'collect' 
+        (a tuple of the elements), a function `reducer(aggregate, value)` that starts with the
+        first value of the group, or a tuple of those to get a tuple of aggregates.
+        `value` selects what gets aggregated, default is the element itself.
+        
+        >>> _(orders).group_by(_.each.customer, ('count', 'sum'), value=_.each.price).dictify()
+        
+        With `max_keys`, at most that many groups are aggregated in memory at the same time. 
+        Elements of other keys are written to partitions in temporary files, which are grouped 
+        (with the same limit) after the groups in memory are done. The elements need to be picklable.
+        Then only the first `max_keys` keys come in the order they were first seen, the other 
+        groups follow one partition after the other, ordered by first appearance within each.
+        """
+        if max_keys is not None and max_keys < 1:
+            raise ValueError('max_keys needs to be at least 1, got %r' % (max_keys,))
+        return _group_by(self, key or _identity, value, _aggregator(agg), max_keys, 0)
+    group_by = tupleize(igroup_by)
+    
+    def tee(self, function, *, max_pending=None, chunk_size=1024):
+        """This override tries to retain iterators, as a speedup
+        
+        On iterators `function` gets a copy of the iterator and has to finish before the chain 
+        continues, so everything it reads is buffered for the chain. With `max_pending`, it 
+        runs in a thread and reads along while the chain does. At most `max_pending` chunks of 
+        `chunk_size` elements are buffered, whoever is ahead waits for the other. Errors of
+        `function` are raised when the chain has read everything.
+        """
+        if not hasattr(self.unwrap, '__next__'): # not an iterator
+            return super().tee(function)
+        if max_pending is None:
             first, second = itertools.tee(self.unwrap, 2)
             function(wrap(first, previous=self))
             return wrap(second, previous=self)
-        else:
-            return super().tee(function)
+        
+        import threading
+        broadcast = _Broadcast(self.unwrap, 2, chunk_size, max_pending)
+        side = threading.Thread(target=broadcast.run, args=(0, lambda elements: function(wrap(elements, previous=self))), daemon=True)
+        producer = threading.Thread(target=broadcast.produce, daemon=True)
+        side.start()
+        producer.start()
+        def chain():
+            try:
+                yield from broadcast.elements(1)
+            finally:
+                broadcast.release(1)
+            side.join()
+            producer.join()
+            broadcast.raise_errors()
+        import weakref
+        iterator = chain()
+        # the finally of chain() never runs if it is dropped before it started
+        weakref.finalize(iterator, broadcast.release, 1)
+        return wrap(iterator, previous=self)
+    
+    def fork(self, *consumers, chunk_size=1024, max_pending=4):
+        """Feed the elements to all consumers in a single pass and return their results.
+        
+        >>> _(numbers).fork(len, sum, collections.Counter)
+        
+        Every consumer is called with a wrapped iterator over the elements, in a thread of 
+        its own. They all share the chunks of `chunk_size` elements read from self, and at 
+        most `max_pending` chunks are buffered for each consumer. When one of them falls 
+        behind, reading waits for it. So unlike `tee()` memory stays bounded, even for 
+        consumers that read everything.
+        
+        Consumers that stop reading early are just left out from then on. Errors of
+        consumers (or while reading self) are raised after all consumers are done.
+        """
+        if len(consumers) == 1:
+            result = consumers[0](self)
+            return wrap((result.unwrap if isinstance(result, Wrapper) else result,), previous=self)
+        
+        import threading
+        broadcast = _Broadcast(self.unwrap, len(consumers), chunk_size, max_pending)
+        threads = [
+            threading.Thread(target=broadcast.run, args=(index, lambda elements, consumer=consumer: consumer(wrap(elements))), daemon=True)
+            for index, consumer in enumerate(consumers)
+        ]
+        for thread in threads:
+            thread.start()
+        broadcast.produce()
+        for thread in threads:
+            thread.join()
+        broadcast.raise_errors()
+        return wrap(tuple(broadcast.results), previous=self)
     
     icycle = wrapped_forward(itertools.cycle)
     cycle = tupleize(icycle)
     
-    iaccumulate = wrapped_forward(itertools.accumulate)
+    iaccumulate = wrapped(itertools.accumulate)
     accumulate = tupleize(iaccumulate)
     
     idropwhile = wrapped_forward(itertools.dropwhile, self_index=1)
@@ -583,98 +1572,1658 @@ class Iterable(Wrapper):
     ifilterfalse = wrapped_forward(itertools.filterfalse, self_index=1)
     filterfalse = tupleize(ifilterfalse)
     
+    @wrapped
+    def igrep(self, pattern, flags=0):
+        """Only the strings where pattern matches somewhere.
+        
+        The pattern is compiled once, see `regex_cache`.
+        
+        >>> _(['foo', 'bar', 'baz']).grep(r'^ba')._ == ('bar', 'baz')
+        """
+        return filter(regex_cache.compile(pattern, flags).search, self)
+    grep = tupleize(igrep)
+    
+    @wrapped
+    def isub(self, pattern, replacement, count=0, flags=0):
+        """Replace pattern in all strings, like `Text.sub()`.
+        
+        The pattern is compiled once, see `regex_cache`.
+        
+        >>> _(['foo', 'bar']).sub(r'[ao]', '_')._ == ('f__', 'b_r')
+        """
+        return map(functools.partial(regex_cache.compile(pattern, flags).sub, replacement, count=count), self)
+    sub = tupleize(isub)
+    
     # TODO make all (applicable?) methods of itertools available here
-
-@protected
-class Mapping(Iterable):
-    """Index into dicts like objects. As JavaScript can."""
     
-    def __getattr__(self, name):
-        "Support JavaScript like dict item access via attribute access"
-        if name in self.unwrap:
-            return self[name]
+    ## Parallel iterators ................................
+    
+    @wrapped
+    def ipmap(self, function, *, chunk_size=None, ordered=True, max_workers=None, max_pending=None, executor=None):
+        """Like `imap()`, but runs `function` in a pool of worker processes.
         
-        return super().__getattr__(name)
+        >>> _(range(10**6)).pmap(_.each ** 2, chunk_size=10**4)
+        
+        The input is cut into chunks of `chunk_size` elements (by default so each worker 
+        gets about four chunks, or 256 elements if the input has no length) which are 
+        sent to the workers. With `ordered=False` results are returned as soon as their 
+        chunk is done, which keeps all workers busy even if some chunks take much longer.
+        
+        At most `max_pending` chunks (default: twice the number of workers) are in flight 
+        at any time, so even infinite iterators can be processed.
+        
+        Functions and elements are sent to the workers by pickling them, so lambdas and 
+        local functions don't work, but functions defined in a module, each expressions 
+        and curried functions do. The results are never wrapped.
+        
+        A `concurrent.futures` executor can be given to reuse its workers, otherwise a 
+        `ProcessPoolExecutor` with `max_workers` is created (and shut down) for every call.
+        """
+        return _iparallel(self, Iterable._map_chunk, function, chunk_size, ordered, max_workers, max_pending, executor)
+    pmap = tupleize(ipmap)
     
-    # REFACT consider rename to splat_call to differentiate that it does something else tha
-    # Callable.star_call
     @wrapped
-    def star_call(self, function, *args, **kwargs):
-        "Calls `function(**self)`, but allows to add args and set defaults for kwargs."
-        return function(*args, **dict(kwargs, **self))
-
-@protected
-class Set(Iterable):
-    """Mostly like Iterable"""
-
-    freeze = wrapped(frozenset)
-
-# REFACT consider to inherit from Iterable? It's how Python works...
-@protected
-class Text(Wrapper):
-    "Supports most of the regex methods as if they where native str methods"
+    def ipstar_map(self, function, *, chunk_size=None, ordered=True, max_workers=None, max_pending=None, executor=None):
+        "Like `istar_map()`, but runs `function` in a pool of worker processes. See `ipmap()`."
+        return _iparallel(self, Iterable._star_map_chunk, function, chunk_size, ordered, max_workers, max_pending, executor)
+    ipstarmap = ipstar_map
+    pstar_map = pstarmap = tupleize(ipstar_map)
     
-    # Regex Methods ......................................
+    @wrapped
+    def ipfilter(self, function, *, chunk_size=None, ordered=True, max_workers=None, max_pending=None, executor=None):
+        "Like `ifilter()`, but runs `function` in a pool of worker processes. See `ipmap()`."
+        return _iparallel(self, Iterable._filter_chunk, function, chunk_size, ordered, max_workers, max_pending, executor)
+    pfilter = tupleize(ipfilter)
     
-    search = wrapped_forward(re.search)
-    match = wrapped_forward(re.match)
-    fullmatch = wrapped_forward(re.match)
-    split = wrapped_forward(re.split)
-    findall = wrapped_forward(re.findall)
-    # REFACT consider ifind and find in the spirit of the collection methods?
-    finditer = wrapped_forward(re.finditer)
-    sub = wrapped_forward(re.sub, self_index=2)
-    subn = wrapped_forward(re.subn, self_index=2)
-
-def _make_operator(name):
-    __op__ = getattr(operator, name)
-    @functools.wraps(__op__)
-    def wrapper(self, *others):
-        # Can't easily use .curry() here, as that would return a wrapped object and I don't want the lambda builder methods to return wrapped objects - yet.
-        # return wrap(__op__).curry(_, *others) #.unwrap
-        # FIXME the order of the placeholder likely needs to depend on the operator. All the __r*__ operators need it reversed?
-        return lambda placeholder: __op__(placeholder, *others)
-    return wrapper
-
-class Each(Wrapper):
-    """Create functions from expressions.
-
-    Use ``each.foo`` to create attrgetters, ``each['foo']`` to create itemgetters,
-    ``each.call.foo()`` to create methodcallers or ``each == 'foo'`` (with pretty much any operator) to create callable operators.
+    # These run in the worker processes, and need to be reachable by name to be pickled
+    @staticmethod
+    def _map_chunk(function, chunk):
+        return tuple(map(function, chunk))
     
-    Note: All generated functions never wrap their arguments or return values.
-    """
+    @staticmethod
+    def _star_map_chunk(function, chunk):
+        return tuple(itertools.starmap(function, chunk))
     
-    for name in dir(operator):
-        if not name.startswith('__') or name == '__doc__':
-            continue
-        locals()[name] = _make_operator(name)
-    del name # prevent promotion to class variable
+    @staticmethod
+    def _filter_chunk(function, chunk):
+        return tuple(filter(function, chunk))
     
-    def __getattr__(self, name):
-        # Experimentally using this to allow attribute access for dictionaries just as all other wrapped dicts would allow
-        return lambda obj: getattr(_(obj), name).unwrap
-        # return operator.attrgetter(name)
+    @wrapped
+    def aiter(self):
+        """Iterate asynchronously, to continue with the methods of `AsyncIterable`.
+        
+        >>> await _(urls).aiter().amap(fetch, concurrency=10).acollect()
+        """
+        return _aiterate(self)
+    
+    def lazy(self):
+        """Switch to lazy mode, where iterator methods only record steps until a result is needed.
+        
+        >>> _(range(10**7)).lazy().map(_.each * 2).filter(_.each > 4).sum()
+        
+        See `Lazy`.
+        """
+        return Lazy(self.unwrap, previous=self, chain=None)
+    
+    def replayable(self, buffer_size=None):
+        """Buffer the elements as they are read, so iterators can be read more than once and indexed.
+        
+        >>> lines = _(open('huge.log')).replayable()
+        >>> lines.get(2)      # reads three lines
+        >>> lines[:10]        # reads seven more
+        >>> lines.map(parse)  # reads the rest, the first ten lines come from the buffer
+        
+        Nothing is read up front. With `buffer_size`, at most that many elements are kept in 
+        memory, older ones are pickled to a temporary file and read back from there when needed.
+        
+        See `Replay`.
+        """
+        return Replayable(Replay(self.unwrap, buffer_size=buffer_size), previous=self, chain=None)
+    memoize = replayable
+
+def _identity(value):
+    return value
+
+def _append(accumulator, value):
+    accumulator.append(value)
+    return accumulator
+
+def _mean_step(accumulator, value):
+    accumulator[0] += 1
+    accumulator[1] += value
+    return accumulator
+
+# name -> (start(first value), step(accumulator, value) -> accumulator, finish(accumulator) or None)
+_aggregators = dict(
+    count=(lambda value: 1, lambda accumulator, value: accumulator + 1, None),
+    sum=(_identity, operator.add, None),
+    min=(_identity, min, None),
+    max=(_identity, max, None),
+    mean=(lambda value: [1, value], _mean_step, lambda accumulator: accumulator[1] / accumulator[0]),
+    first=(_identity, lambda accumulator, value: accumulator, None),
+    last=(_identity, lambda accumulator, value: value, None),
+    collect=(lambda value: [value], _append, tuple),
+)
+
+def _aggregator(agg):
+    "Resolve the `agg` argument of `Iterable.igroup_by()` to (start, step, finish)"
+    if isinstance(agg, str):
+        if agg not in _aggregators:
+            raise ValueError('Aggregation needs to be one of %r or a function, got %r' % (tuple(_aggregators), agg))
+        return _aggregators[agg]
+    if callable(agg):
+        return (_identity, agg, None)
+    
+    aggregators = tuple(map(_aggregator, agg))
+    def start(value):
+        return [start(value) for start, step, finish in aggregators]
+    def step(accumulators, value):
+        for index, (start, step, finish) in enumerate(aggregators):
+            accumulators[index] = step(accumulators[index], value)
+        return accumulators
+    def finish(accumulators):
+        return tuple(accumulator if finish is None else finish(accumulator) 
+            for accumulator, (start, step, finish) in zip(accumulators, aggregators))
+    return (start, step, finish)
+
+def _group_by(iterable, key_function, value_function, aggregator, max_keys, depth):
+    "Aggregate the elements in a dict by key, spilling (key, value) pairs of keys beyond `max_keys` to partitions"
+    start, step, finish = aggregator
+    groups = {}
+    partitions = None
+    for element in iterable:
+        key = key_function(element)
+        value = element if value_function is None else value_function(element)
+        if key in groups:
+            groups[key] = step(groups[key], value)
+        elif max_keys is None or len(groups) < max_keys:
+            groups[key] = start(value)
+        else:
+            if partitions is None:
+                partitions = _Partitions(depth)
+            partitions.add(key, value)
+    
+    for key, accumulator in groups.items():
+        yield key, accumulator if finish is None else finish(accumulator)
+    del groups
+    if partitions is not None:
+        for partition in partitions.read():
+            yield from _group_by(partition, operator.itemgetter(0), operator.itemgetter(1), aggregator, max_keys, depth + 1)
+
+class _Partitions(object):
+    "Temporary files that pairs are distributed to by the hash of their key"
+    
+    COUNT = 16
+    BATCH_SIZE = 1024
+    
+    def __init__(self, depth):
+        import tempfile
+        self.depth = depth # salts the hash, so keys that landed in one partition get split up in the next level
+        self.files = [tempfile.TemporaryFile() for _ignored in range(self.COUNT)]
+        self.batches = [[] for _ignored in range(self.COUNT)]
+    
+    def add(self, key, value):
+        index = hash((self.depth, key)) % self.COUNT
+        batch = self.batches[index]
+        batch.append((key, value))
+        if len(batch) >= self.BATCH_SIZE:
+            self._write(index)
+    
+    def _write(self, index):
+        import pickle
+        pickle.dump(self.batches[index], self.files[index], protocol=pickle.HIGHEST_PROTOCOL)
+        self.batches[index] = []
+    
+    def read(self):
+        "Iterator of the partitions, each an iterator of pairs. Closes the files as it goes"
+        import pickle
+        for index, file in enumerate(self.files):
+            if self.batches[index]:
+                self._write(index)
+            def pairs(file=file):
+                with file:
+                    file.seek(0)
+                    while True:
+                        try:
+                            yield from pickle.load(file)
+                        except EOFError:
+                            return
+            yield pairs()
+
+class _Broadcast(object):
+    """Feed the elements of one iterator to several consumers, through a bounded queue of chunks for each.
+    
+    The chunks are shared, so memory is bounded by `max_pending` chunks per consumer.
+    """
+    
+    _END = object()
+    
+    def __init__(self, iterable, count, chunk_size, max_pending):
+        import queue
+        assert chunk_size >= 1 and max_pending >= 1, 'chunk_size and max_pending need to be at least 1'
+        self.iterable = iterable
+        self.chunk_size = chunk_size
+        self.queues = [queue.Queue(max_pending) for _ignored in range(count)]
+        self.done = [False] * count
+        self.results = [None] * count
+        self.errors = [] # in the order they happened
+    
+    def produce(self):
+        "Read the iterable and put each chunk into the queues of the consumers that are still reading"
+        try:
+            iterator = iter(self.iterable)
+            for chunk in iter(lambda: tuple(itertools.islice(iterator, self.chunk_size)), ()):
+                for index, queue in enumerate(self.queues):
+                    if not self.done[index]:
+                        queue.put(chunk) # waits while this consumer is max_pending chunks behind
+                if all(self.done):
+                    break
+        except BaseException as error:
+            self.errors.append(error)
+        finally:
+            for index, queue in enumerate(self.queues):
+                if not self.done[index]:
+                    queue.put(self._END)
+    
+    def elements(self, index):
+        "Iterator over the elements for consumer `index`"
+        queue = self.queues[index]
+        while True:
+            chunk = queue.get()
+            if chunk is self._END:
+                return
+            yield from chunk
+    
+    def release(self, index):
+        "Stop feeding consumer `index` and drop what it didn't read, so the producer doesn't wait for it"
+        import queue
+        self.done[index] = True
+        try:
+            while True:
+                self.queues[index].get_nowait()
+        except queue.Empty:
+            pass
+    
+    def run(self, index, consumer):
+        "Call `consumer` with the elements for `index` and keep its result or error, for threads"
+        try:
+            result = consumer(self.elements(index))
+            self.results[index] = result.unwrap if isinstance(result, Wrapper) else result
+        except BaseException as error:
+            self.errors.append(error)
+        finally:
+            self.release(index)
+    
+    def raise_errors(self):
+        if self.errors:
+            raise self.errors[0]
+
+_SKETCH_HASH_MASK = (1 << 64) - 1
+
+def _mix_hash(value):
+    "Spread the bits of a 64 bit number over all bits of the result (splitmix64 finalizer)"
+    value = (value ^ (value >> 30)) * 0xbf58476d1ce4e5b9 & _SKETCH_HASH_MASK
+    value = (value ^ (value >> 27)) * 0x94d049bb133111eb & _SKETCH_HASH_MASK
+    return value ^ (value >> 31)
+
+def _digest_hash(data, kind):
+    import hashlib
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8, person=kind).digest(), 'little')
+
+def _sketch_hash(value):
+    """64 bit hash for the sketches, that is the same in every process for str, bytes and numbers.
+    
+    hash() of str and bytes changes with every process, but shards may be sketched in different 
+    ones. And hash() of numbers is the number modulo 2**61-1 (and -2 for -1), so it has 
+    collisions between small numbers and its low bits are anything but random.
+    """
+    if type(value) is float and value.is_integer():
+        value = int(value) # equal numbers get the same hash, like with hash()
+    if isinstance(value, int):
+        if -(1 << 63) <= value < (1 << 63):
+            return _mix_hash(value & _SKETCH_HASH_MASK)
+        return _digest_hash(value.to_bytes(value.bit_length() // 8 + 1, 'little', signed=True), b'int')
+    if type(value) is float:
+        return _digest_hash(value.hex().encode('ascii'), b'float')
+    if isinstance(value, str):
+        return _digest_hash(value.encode('utf-8', 'surrogatepass'), b'str')
+    if isinstance(value, (bytes, bytearray)):
+        return _digest_hash(value, b'bytes')
+    return _mix_hash(hash(value) & _SKETCH_HASH_MASK)
+
+@protected
+class BloomFilter(object):
+    """Set of hashable values that only answers 'probably seen' or 'certainly not seen', in a fixed amount of memory.
+    
+    Sized for `capacity` values with a false positive rate of `error_rate`, more values raise
+    the rate. Values that are not str, bytes or numbers are hashed with `hash()`, so values 
+    with the same `hash()` always collide.
+    
+    >>> seen = _.BloomFilter(capacity=10**9, error_rate=0.001) # about 1.8 GB
+    >>> seen.add('foo') # False, was not seen before
+    >>> 'foo' in seen # True
+    """
+    
+    def __init__(self, capacity, error_rate=0.001):
+        assert capacity >= 1 and 0 < error_rate < 1, 'Need capacity >= 1 and 0 < error_rate < 1, got %r and %r' % (capacity, error_rate)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)) # in bits
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0 # values added that were not seen before
+    
+    def __repr__(self):
+        return 'BloomFilter(capacity=%r, error_rate=%r) with %i values' % (self.capacity, self.error_rate, self.count)
+    
+    def _positions(self, value):
+        # double hashing, two independent hashes are enough to derive all of them
+        size = self.size
+        hashed = _sketch_hash(value)
+        position = hashed % size
+        step = _mix_hash(hashed ^ 0x9e3779b97f4a7c15) % size or 1
+        for index in range(self.hash_count):
+            yield position
+            position += step
+            if position >= size:
+                position -= size
+    
+    def __contains__(self, value):
+        bits = self.bits
+        for position in self._positions(value):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+    
+    def add(self, value):
+        "Add value, returns if it was (probably) seen before"
+        bits = self.bits
+        seen = True
+        for position in self._positions(value):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                seen = False
+        if not seen:
+            self.count += 1
+        return seen
+    
+    def __len__(self):
+        return self.count
+
+@protected
+class HyperLogLog(object):
+    """Estimate of the number of distinct values, in 2**`precision` bytes regardless of how many there are.
+    
+    >>> visitors = _.HyperLogLog().update(monday) | _.HyperLogLog().update(tuesday)
+    >>> visitors.estimate()
+    
+    Sketches with the same precision can be merged, the result is the sketch of all their values.
+    Values that are not str, bytes or numbers are hashed with `hash()`, then sketches are only 
+    mergeable within one process.
+    """
+    
+    def __init__(self, precision=14):
+        assert 4 <= precision <= 18, 'Need 4 <= precision <= 18, got %r' % (precision,)
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+    
+    def __repr__(self):
+        return 'HyperLogLog(precision=%r) estimating %i distinct values' % (self.precision, self.estimate())
+    
+    def add(self, value):
+        self.update((value,))
+    
+    def update(self, iterable):
+        "Add all values of iterable, returns self"
+        registers = self.registers
+        bits = 64 - self.precision
+        mask = (1 << bits) - 1
+        for value in iterable:
+            hashed = _sketch_hash(value)
+            rank = bits - (hashed & mask).bit_length() + 1 # position of the first 1 bit
+            if rank > registers[hashed >> bits]:
+                registers[hashed >> bits] = rank
+        return self
+    
+    def estimate(self):
+        "Estimated number of distinct values added"
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / math.fsum(2.0 ** -register for register in self.registers)
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * size and empty:
+            return size * math.log(size / empty) # linear counting is better for few values
+        return estimate
+    
+    def __len__(self):
+        return round(self.estimate())
+    
+    def merge(self, *others):
+        "Add the values of other sketches with the same precision, returns self"
+        for other in others:
+            if other.precision != self.precision:
+                raise ValueError('precision needs to be %r, got %r' % (self.precision, other.precision))
+            self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+    
+    def __or__(self, other):
+        return HyperLogLog(self.precision).merge(self, other)
+
+@protected
+class MisraGries(object):
+    """The frequent values and lower bounds of their counts, in `k` counters.
+    
+    >>> hits = _.MisraGries(100).update(paths)
+    >>> hits.most_common(10)
+    
+    Every value that was added more than `total` / (k+1) times has a counter, and its count 
+    is at most that much too low. Sketches with the same `k` can be merged.
+    """
+    
+    def __init__(self, k):
+        assert k >= 1, 'Need k >= 1, got %r' % (k,)
+        self.k = k
+        self.counters = dict()
+        self.total = 0
+    
+    def __repr__(self):
+        return 'MisraGries(%r) of %i values with %r' % (self.k, self.total, self.most_common(3))
+    
+    def add(self, value):
+        self.total += 1
+        counters = self.counters
+        if value in counters:
+            counters[value] += 1
+        elif len(counters) < self.k:
+            counters[value] = 1
+        else:
+            # every counter goes down for every value counted here, so this runs at most total / k times
+            for other in list(counters):
+                if counters[other] == 1:
+                    del counters[other]
+                else:
+                    counters[other] -= 1
+    
+    def update(self, iterable):
+        "Add all values of iterable, returns self"
+        add = self.add
+        for value in iterable:
+            add(value)
+        return self
+    
+    def __getitem__(self, value):
+        "Lower bound for how often value was added"
+        return self.counters.get(value, 0)
+    
+    @property
+    def error(self):
+        "Upper bound for how much each count is too low"
+        return self.total // (self.k + 1)
+    
+    def most_common(self, n=None):
+        "Like `collections.Counter.most_common()`, (value, count) pairs with the highest counts first"
+        import heapq
+        if n is None:
+            return sorted(self.counters.items(), key=operator.itemgetter(1), reverse=True)
+        return heapq.nlargest(n, self.counters.items(), key=operator.itemgetter(1))
+    
+    def merge(self, *others):
+        "Add the values of other sketches with the same k, returns self"
+        counters = self.counters
+        for other in others:
+            if other.k != self.k:
+                raise ValueError('k needs to be %r, got %r' % (self.k, other.k))
+            self.total += other.total
+            for value, count in other.counters.items():
+                counters[value] = counters.get(value, 0) + count
+            if len(counters) > self.k:
+                # subtract the (k+1)th largest count from all, which leaves at most k of them
+                cut = sorted(counters.values(), reverse=True)[self.k]
+                self.counters = counters = {value: count - cut for value, count in counters.items() if count > cut}
+        return self
+    
+    def __or__(self, other):
+        return MisraGries(self.k).merge(self, other)
+
+@protected
+class KLL(object):
+    """Approximate quantiles and ranks of comparable values, in about 3*`k` of them.
+    
+    >>> durations = _.KLL().update(monday) | _.KLL().update(tuesday)
+    >>> durations.quantiles(0.5, 0.9, 0.99)
+    
+    Values are kept in levels, when a level is full it is sorted and every other value moves up
+    a level, where it stands for twice as many values (Karnin, Lang, Liberty 2016).
+    The rank error is about 1.7 / `k`. Sketches with the same `k` can be merged.
+    """
+    
+    def __init__(self, k=200):
+        assert k >= 8, 'Need k >= 8, got %r' % (k,)
+        self.k = k
+        self.levels = [[]]
+        self.total = 0
+        self._size = 0 # values kept
+        self._capacity = self._level_capacity(0)
+    
+    def __repr__(self):
+        return 'KLL(%r) of %i values with median %r' % (self.k, self.total, self.quantile(0.5) if self.total else None)
+    
+    def _level_capacity(self, level):
+        # the highest level keeps k values, capacities shrink by 2/3 per level down
+        return max(2, math.ceil(self.k * (2 / 3) ** (len(self.levels) - level - 1)))
+    
+    def _compress(self):
+        import random
+        for level, values in enumerate(self.levels):
+            if len(values) >= self._level_capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append([])
+                    self._capacity = sum(map(self._level_capacity, range(len(self.levels))))
+                values.sort()
+                self.levels[level + 1].extend(values[random.getrandbits(1)::2])
+                values.clear()
+                self._size = sum(map(len, self.levels))
+                if self._size < self._capacity:
+                    return
+    
+    def add(self, value):
+        self.total += 1
+        self.levels[0].append(value)
+        self._size += 1
+        if self._size >= self._capacity:
+            self._compress()
+    
+    def update(self, iterable):
+        "Add all values of iterable, returns self"
+        add = self.add
+        for value in iterable:
+            add(value)
+        return self
+    
+    def _weighted(self):
+        "Sorted (value, weight) pairs, each value stands for weight of the values added"
+        return sorted((value, 1 << level) for level, values in enumerate(self.levels) for value in values)
+    
+    def rank(self, value):
+        "Approximate fraction of the values that are smaller than value"
+        weighted = self._weighted()
+        assert weighted, 'Need values for rank'
+        return sum(weight for each, weight in weighted if each < value) / sum(weight for each, weight in weighted)
+    
+    def quantiles(self, *fractions):
+        "Approximate values below which each of the fractions of all values lie"
+        assert self.total, 'Need values for quantiles'
+        weighted = self._weighted()
+        weight = sum(weight for value, weight in weighted)
+        results = []
+        for fraction in fractions:
+            assert 0 <= fraction <= 1, 'Need 0 <= fraction <= 1, got %r' % (fraction,)
+            target, cumulative = fraction * weight, 0
+            for value, value_weight in weighted:
+                cumulative += value_weight
+                if cumulative >= target:
+                    break
+            results.append(value)
+        return tuple(results)
+    
+    def quantile(self, fraction):
+        return self.quantiles(fraction)[0]
+    
+    def merge(self, *others):
+        "Add the values of other sketches with the same k, returns self"
+        for other in others:
+            if other.k != self.k:
+                raise ValueError('k needs to be %r, got %r' % (self.k, other.k))
+            while len(self.levels) < len(other.levels):
+                self.levels.append([])
+            for values, other_values in zip(self.levels, other.levels):
+                values.extend(other_values)
+            self.total += other.total
+            self._size = sum(map(len, self.levels))
+            self._capacity = sum(map(self._level_capacity, range(len(self.levels))))
+            while self._size >= self._capacity:
+                self._compress()
+        return self
+    
+    def __or__(self, other):
+        return KLL(self.k).merge(self, other)
+
+_join_hows = ('inner', 'left', 'right', 'outer')
+
+def _check_join_how(how):
+    if how not in _join_hows:
+        raise ValueError('how needs to be one of %r, got %r' % (_join_hows, how))
+
+def _hash_join(streamed, streamed_key, indexed, indexed_key, keep_streamed, keep_indexed):
+    "(streamed, indexed) pairs with equal keys. `keep_*` pairs unmatched elements of that side with None"
+    index = {}
+    for element in indexed:
+        index.setdefault(indexed_key(element), []).append(element)
+    matched = set()
+    for element in streamed:
+        key = streamed_key(element)
+        matches = index.get(key)
+        if matches is None:
+            if keep_streamed:
+                yield element, None
+            continue
+        if keep_indexed:
+            matched.add(key)
+        for match in matches:
+            yield element, match
+    if keep_indexed:
+        for key, elements in index.items():
+            if key not in matched:
+                for element in elements:
+                    yield None, element
+
+def _merge_join(left, left_key, right, right_key, keep_left, keep_right):
+    "(left, right) pairs with equal keys from two inputs sorted by key"
+    left_groups = itertools.groupby(left, left_key)
+    right_groups = itertools.groupby(right, right_key)
+    left_group = next(left_groups, None)
+    right_group = next(right_groups, None)
+    while left_group is not None and right_group is not None:
+        if left_group[0] < right_group[0]:
+            if keep_left:
+                yield from ((element, None) for element in left_group[1])
+            left_group = next(left_groups, None)
+        elif right_group[0] < left_group[0]:
+            if keep_right:
+                yield from ((None, element) for element in right_group[1])
+            right_group = next(right_groups, None)
+        else:
+            rights = tuple(right_group[1])
+            for element in left_group[1]:
+                for match in rights:
+                    yield element, match
+            left_group = next(left_groups, None)
+            right_group = next(right_groups, None)
+    while keep_left and left_group is not None:
+        yield from ((element, None) for element in left_group[1])
+        left_group = next(left_groups, None)
+    while keep_right and right_group is not None:
+        yield from ((None, element) for element in right_group[1])
+        right_group = next(right_groups, None)
+
+_SORT_BATCH_SIZE = 1024 # elements per pickle in the runs of _external_sorted()
+
+def _external_sorted(iterable, key, reverse, run_size):
+    "Sort runs of `run_size` elements, spill them to temporary files and merge them lazily"
+    assert run_size >= 1, 'run_size needs to be at least 1, got %r' % (run_size,)
+    iterator = iter(iterable)
+    run = sorted(itertools.islice(iterator, run_size), key=key, reverse=reverse)
+    if len(run) < run_size:
+        yield from run # everything fits into memory
+        return
+    
+    import heapq, pickle, tempfile
+    files = []
+    try:
+        while run:
+            file = tempfile.TemporaryFile()
+            files.append(file)
+            for start in range(0, len(run), _SORT_BATCH_SIZE):
+                pickle.dump(run[start:start + _SORT_BATCH_SIZE], file, protocol=pickle.HIGHEST_PROTOCOL)
+            run = sorted(itertools.islice(iterator, run_size), key=key, reverse=reverse)
+        
+        def read(file):
+            file.seek(0)
+            while True:
+                try:
+                    yield from pickle.load(file)
+                except EOFError:
+                    return
+        yield from heapq.merge(*map(read, files), key=key, reverse=reverse)
+    finally:
+        for file in files:
+            file.close()
+
+def _is_flatten_leaf(element):
+    "Iterables that flatten() keeps whole by default. Strings would never stop, as their elements are strings again."
+    return isinstance(element, (str, bytes, bytearray, collections.abc.Mapping))
+
+def _picklable(function):
+    "Undo the optimizations that prevent sending functions to other processes"
+    if isinstance(function, Each):
+        return _each_element
+    if isinstance(function, Wrapper):
+        function = function.unwrap
+    tree = getattr(function, '_each_tree', None)
+    if tree is not None:
+        return EachExpression(tree)
+    return function
+
+def _iparallel(iterable, chunk_function, function, chunk_size, ordered, max_workers, max_pending, executor):
+    "Feed chunks of `iterable` to `chunk_function` in worker processes, with a bounded number of chunks in flight"
+    import concurrent.futures
+    
+    function = _picklable(function)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = 256
+        if isinstance(iterable, collections.abc.Sized):
+            chunk_size = max(1, math.ceil(len(iterable) / (4 * max_workers)))
+    if max_pending is None:
+        max_pending = 2 * max_workers
+    
+    own_executor = executor is None
+    if own_executor:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers)
+    
+    iterator = iter(iterable)
+    chunks = iter(lambda: tuple(itertools.islice(iterator, chunk_size)), ())
+    pending = collections.deque()
+    try:
+        if ordered:
+            for chunk in chunks:
+                pending.append(executor.submit(chunk_function, function, chunk))
+                if len(pending) >= max_pending:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        else:
+            for chunk in chunks:
+                pending.append(executor.submit(chunk_function, function, chunk))
+                if len(pending) >= max_pending:
+                    done, not_done = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    pending = collections.deque(not_done)
+                    for future in done:
+                        yield from future.result()
+            for future in concurrent.futures.as_completed(tuple(pending)):
+                pending.remove(future)
+                yield from future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown()
+
+def _lazy(iterator_method):
+    """Adapt an iterator method of Iterable so it records a step on a Lazy pipeline.
+    
+    The step runs the original iterator method when the pipeline is built.
+    """
+    @functools.wraps(iterator_method)
+    def recorder(self, *args, **kwargs):
+        def step(iterator):
+            return iterator_method(Iterable(iterator, previous=None, chain=None), *args, **kwargs).unwrap
+        return self._with_step(iterator_method.__name__.lstrip('i'), step)
+    return recorder
+
+@protected
+class Lazy(Iterable):
+    """Record iterator steps and only run them when a result is needed.
+    
+    In lazy mode `map()`, `filter()`, `star_map()` and the other iterator methods don't 
+    create tuples, they just record a step. Once a terminal method like `collect()`, `sum()`, 
+    `len()`, `reduce()` or `join()` needs the result, all steps are chained into one 
+    pipeline of iterators that processes one element after the other in a single pass. 
+    No intermediate tuples are created, so memory use doesn't grow with the input size.
+    
+        >>> pipeline = _(range(10)).lazy().map(_.each * 2).filter(_.each > 4)
+        >>> pipeline.sum()._ == 84
+        >>> pipeline.collect()._ == (6, 8, 10, 12, 14, 16, 18)
+    
+    The pipeline is rebuilt for every terminal method, so it can be reused as long as 
+    the source can be iterated more than once.
+    
+    Methods that need to see all elements (`sorted()`, `reversed()`) are steps too, but 
+    they buffer the elements of their input while they run.
+    """
+    
+    def __init__(self, wrapped, *, previous, chain, history=None, steps=()):
+        super().__init__(wrapped, previous=previous, chain=chain, history=history)
+        self.__steps = steps
+    
+    def __repr__(self):
+        return "fluentpy.wrap(%r).lazy()%s" % (super().unwrap, ''.join('.%s()' % name for name, step in self.__steps))
+    
+    @property
+    def unwrap(self):
+        """Returns an iterator that runs all recorded steps over the wrapped value."""
+        iterator = super().unwrap
+        if _profile is not None:
+            stages = _profile.stages(self.__steps, iterator)
+            if stages is not None:
+                return stages
+        for name, step in self.__steps:
+            iterator = step(iterator)
+        return iterator
+    _ = unwrap # alias
+    
+    @property
+    def steps(self):
+        "Names of the recorded steps"
+        return tuple(name for name, step in self.__steps)
+    
+    def _with_step(self, name, step):
+        return Lazy(super().unwrap, previous=self, chain=None, steps=self.__steps + ((name, step),))
+    
+    def lazy(self):
+        return self
+    
+    ## Steps .............................................
+    
+    map = imap = _lazy(Iterable.imap)
+    star_map = starmap = istar_map = istarmap = _lazy(Iterable.istarmap)
+    filter = ifilter = _lazy(Iterable.ifilter)
+    enumerate = ienumerate = _lazy(Iterable.ienumerate)
+    zip = izip = _lazy(Iterable.izip)
+    grouped = igrouped = _lazy(Iterable.igrouped)
+    flatten = iflatten = _lazy(Iterable.iflatten)
+    cycle = icycle = _lazy(Iterable.icycle)
+    accumulate = iaccumulate = _lazy(Iterable.iaccumulate)
+    dropwhile = idropwhile = _lazy(Iterable.idropwhile)
+    filterfalse = ifilterfalse = _lazy(Iterable.ifilterfalse)
+    sorted = isorted = _lazy(Iterable.isorted)
+    group_by = igroup_by = _lazy(Iterable.igroup_by)
+    unique = iunique = _lazy(Iterable.iunique)
+    join_on = ijoin_on = _lazy(Iterable.ijoin_on)
+    merge_join = imerge_join = _lazy(Iterable.imerge_join)
+    grep = igrep = _lazy(Iterable.igrep)
+    sub = isub = _lazy(Iterable.isub)
+    pmap = ipmap = _lazy(Iterable.ipmap)
+    pstar_map = pstarmap = ipstar_map = ipstarmap = _lazy(Iterable.ipstar_map)
+    pfilter = ipfilter = _lazy(Iterable.ipfilter)
+    
+    def reversed(self):
+        return self._with_step('reversed', lambda iterator: reversed(tuple(iterator)))
+    ireversed = reversed
+    
+    ## Terminals .........................................
+    
+    def collect(self):
+        "Run the pipeline and return all results as a tuple"
+        return wrap(tuple(self.unwrap), previous=self)
+    
+    def len(self):
+        "Run the pipeline and count the results without keeping them"
+        count = 0
+        for count, element in enumerate(self.unwrap, 1):
+            pass
+        return wrap(count, previous=self)
+
+@protected
+class Replay(object):
+    """Sequence over an iterator, that reads the iterator only as far as it is accessed.
+    
+    Every element read from the iterator is kept, so iterating again, indexing and slicing 
+    replays it from the buffer. `len()`, negative indexes and slices need to read everything.
+    
+    With `buffer_size`, at most that many elements are kept in memory. Older elements are 
+    pickled to a temporary file in chunks of half the buffer size, and read back one chunk
+    at a time. So the elements need to be picklable, and replaying them will create copies.
+    """
+    
+    def __init__(self, iterable, buffer_size=None):
+        assert buffer_size is None or buffer_size >= 1, 'buffer_size needs to be at least 1, got %r' % (buffer_size,)
+        self._iterator = iter(iterable)
+        self._exhausted = False
+        self._elements = [] # elements read from self._iterator that are still in memory
+        self._spilled = 0 # number of elements before self._elements, they are in self._file
+        self._buffer_size = buffer_size
+        self._chunk_size = None if buffer_size is None else max(1, buffer_size // 2)
+        self._file = None
+        self._offsets = [] # start of each spilled chunk in self._file
+        self._loaded = (None, None) # (index, elements) of the chunk last read back from self._file
+    
+    def __repr__(self):
+        return '%s(<%i elements read%s>)' % (type(self).__name__, self.buffered, '' if self._exhausted else ', more to come')
+    
+    @property
+    def buffered(self):
+        "Number of elements read from the iterator so far"
+        return self._spilled + len(self._elements)
+    
+    def _fill(self, count):
+        "Read from the iterator until `count` elements are buffered. Returns if there are that many."
+        while self.buffered < count:
+            if self._exhausted:
+                return False
+            try:
+                self._elements.append(next(self._iterator))
+            except StopIteration:
+                self._exhausted = True
+                self._iterator = None
+                return False
+            if self._buffer_size is not None and len(self._elements) > self._buffer_size:
+                self._spill()
+        return True
+    
+    def _exhaust(self):
+        self._fill(math.inf)
+    
+    def _spill(self):
+        import pickle
+        if self._file is None:
+            import tempfile
+            self._file = tempfile.TemporaryFile()
+        self._file.seek(0, os.SEEK_END)
+        self._offsets.append(self._file.tell())
+        pickle.dump(self._elements[:self._chunk_size], self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        del self._elements[:self._chunk_size]
+        self._spilled += self._chunk_size
+    
+    def _element(self, index):
+        "Element at a non negative index that is already buffered"
+        if index >= self._spilled:
+            return self._elements[index - self._spilled]
+        chunk, offset = divmod(index, self._chunk_size)
+        if self._loaded[0] != chunk:
+            import pickle
+            self._file.seek(self._offsets[chunk])
+            self._loaded = (chunk, pickle.load(self._file))
+        return self._loaded[1][offset]
+    
+    def __iter__(self):
+        index = 0
+        while index < self.buffered or self._fill(index + 1):
+            yield self._element(index)
+            index += 1
+    
+    def __len__(self):
+        self._exhaust()
+        return self.buffered
     
     def __getitem__(self, index):
-        return operator.itemgetter(index)
+        if isinstance(index, slice):
+            # backwards the start is the furthest element, and None means the last one
+            backwards = index.step is not None and index.step < 0
+            end = index.start + 1 if backwards and index.start is not None else None if backwards else index.stop
+            if end is None or any(value is not None and value < 0 for value in (index.start, index.stop)):
+                self._exhaust()
+            else:
+                self._fill(end)
+            return tuple(self._element(position) for position in range(*index.indices(self.buffered)))
+        
+        index = operator.index(index)
+        if index < 0:
+            self._exhaust()
+            index += self.buffered
+        if index < 0 or not self._fill(index + 1):
+            raise IndexError('Replay index out of range')
+        return self._element(index)
+    
+    def get(self, index, default=None):
+        "Like `self[index]`, but returns default if there is no such element"
+        try:
+            return self[index]
+        except IndexError:
+            return default
+    
+    def close(self):
+        "Drop the buffer and delete the temporary file, if any. Afterwards it is empty."
+        self._iterator = None
+        self._exhausted = True
+        self._elements = []
+        self._spilled = 0
+        self._offsets = []
+        self._loaded = (None, None)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+@protected
+class Replayable(Iterable):
+    """Wrapper for `Replay`, see `Iterable.replayable()`.
+    
+    `get()` reads only as far as the index, even with a default.
+    """
+    
+    @wrapped
+    def get(self, index, default=get_default_marker):
+        if default is get_default_marker:
+            return self[index]
+        return self.get(index, default)
+    
+    def replayable(self, buffer_size=None):
+        return self
+    memoize = replayable
+
+async def _aiterate(iterable):
+    for element in iterable:
+        yield element
+
+async def _acall(function, element):
+    "Call function and await the result if it is awaitable, so plain and coroutine functions can be used"
+    result = function(element)
+    if hasattr(result, '__await__'):
+        result = await result
+    return result
+
+async def _amap(async_iterable, function, concurrency, ordered):
+    if concurrency is None:
+        async for element in async_iterable:
+            yield await _acall(function, element)
+        return
+    
+    import asyncio
+    pending = collections.deque()
+    async def completed():
+        "Remove and return the results of the next finished tasks"
+        nonlocal pending
+        if ordered:
+            return (await pending.popleft(),)
+        done, not_done = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        pending = collections.deque(not_done)
+        return tuple(task.result() for task in done)
+    
+    try:
+        async for element in async_iterable:
+            pending.append(asyncio.ensure_future(_acall(function, element)))
+            if len(pending) >= concurrency:
+                for result in await completed():
+                    yield result
+        while pending:
+            for result in await completed():
+                yield result
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def _afilter_check(function, element):
+    return element, await _acall(function, element)
+
+async def _afilter(async_iterable, function, concurrency, ordered):
+    async for element, is_selected in _amap(async_iterable, functools.partial(_afilter_check, function), concurrency, ordered):
+        if is_selected:
+            yield element
+
+async def _aflatten(async_iterable, level):
+    async for element in async_iterable:
+        if level > 0 and hasattr(element, '__aiter__'):
+            async for subelement in _aflatten(element, level - 1):
+                yield subelement
+        elif level > 0 and isinstance(element, collections.abc.Iterable) and not _is_flatten_leaf(element):
+            async for subelement in _aflatten(_aiterate(element), level - 1):
+                yield subelement
+        else:
+            yield element
+
+@protected
+class AsyncIterable(Wrapper):
+    """Add iterator methods to async iterables like async generators.
+    
+        >>> await _(async_generator()).amap(fetch, concurrency=10).afilter(_.each.ok).acollect()
+    
+    All methods except `acollect()` return async iterables again, so they can be chained. 
+    Nothing happens until the result is iterated with `async for` or `acollect()`.
+    
+    Functions given to `amap()` and `afilter()` can be plain or coroutine functions. 
+    By default they are awaited one after the other. With `concurrency=N` up to N calls 
+    are in flight at the same time, and `ordered=False` returns results as soon as they 
+    are done instead of in the order of the input.
+    
+    Just like with `Iterable`, the elements are not wrapped.
+    """
+    
+    def __aiter__(self):
+        return self.unwrap.__aiter__()
+    
+    @wrapped
+    def amap(self, function, *, concurrency=None, ordered=True):
+        "Like `Iterable.imap()`, but `function` may return awaitables and run concurrently."
+        return _amap(self, function, concurrency, ordered)
+    
+    @wrapped
+    def afilter(self, function, *, concurrency=None, ordered=True):
+        "Like `Iterable.ifilter()`, but `function` may return awaitables and run concurrently."
+        return _afilter(self, function, concurrency, ordered)
+    
+    @wrapped
+    def aflatten(self, level=math.inf):
+        "Like `Iterable.iflatten()`, flattens sync and async iterables. Strings and bytes are not flattened."
+        return _aflatten(self, level)
+    
+    async def acollect(self):
+        "Await all elements and return them as a (wrapped) tuple"
+        return wrap(tuple([element async for element in self.unwrap]), previous=self)
+
+@protected
+class Mapping(Iterable):
+    """Index into dicts like objects. As JavaScript can."""
+    
+    def __getattr__(self, name):
+        "Support JavaScript like dict item access via attribute access"
+        if name in self.unwrap:
+            return self[name]
+        
+        return super().__getattr__(name)
+    
+    # REFACT consider rename to splat_call to differentiate that it does something else tha
+    # Callable.star_call
+    @wrapped
+    def star_call(self, function, *args, **kwargs):
+        "Calls `function(**self)`, but allows to add args and set defaults for kwargs."
+        return function(*args, **dict(kwargs, **self))
+
+@protected
+class Set(Iterable):
+    """Mostly like Iterable"""
+
+    freeze = wrapped(frozenset)
+
+@protected
+class RegexCache(object):
+    """Least recently used cache of compiled regular expressions.
+    
+    All regex methods of `Text` and `Iterable` compile their patterns through `regex_cache`.
+    Unlike the cache in `re`, which is cleared once it grows beyond a few hundred patterns, 
+    this one only evicts the least recently used patterns, and its size can be configured:
+        
+        >>> _.regex_cache.maxsize = 10000
+        >>> _.regex_cache.info()
+        {'hits': 1042, 'misses': 17, 'maxsize': 10000, 'size': 17}
+    
+    Compiled patterns are passed through as they are.
+    """
+    
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._patterns = collections.OrderedDict()
+    
+    def compile(self, pattern, flags=0):
+        "Like re.compile(), but cached"
+        if not isinstance(pattern, (str, bytes)):
+            if flags:
+                raise ValueError('Cannot process flags argument with a compiled pattern')
+            return pattern
+        
+        key = (pattern, flags)
+        compiled = self._patterns.get(key)
+        if compiled is not None:
+            self.hits += 1
+            try:
+                self._patterns.move_to_end(key)
+            except KeyError:
+                pass # evicted by another thread in the meantime
+            return compiled
+        
+        self.misses += 1
+        import re
+        compiled = self._patterns[key] = re.compile(pattern, flags)
+        while len(self._patterns) > self.maxsize:
+            self._patterns.popitem(last=False)
+        return compiled
+    
+    def info(self):
+        "Hit and miss statistics"
+        return dict(hits=self.hits, misses=self.misses, maxsize=self.maxsize, size=len(self._patterns))
+    
+    def clear(self):
+        "Remove all patterns and reset the statistics"
+        self._patterns.clear()
+        self.hits = self.misses = 0
+
+regex_cache = RegexCache()
+protected(regex_cache, 'regex_cache')
+
+# REFACT consider to inherit from Iterable? It's how Python works...
+@protected
+class Text(Wrapper):
+    """Supports most of the regex methods as if they where native str methods
+    
+    Patterns can be strings or compiled patterns, strings are compiled via `regex_cache`.
+    """
+    
+    # Regex Methods ......................................
+    
+    @wrapped
+    def search(self, pattern, flags=0):
+        return regex_cache.compile(pattern, flags).search(self)
+    
+    @wrapped
+    def match(self, pattern, flags=0):
+        return regex_cache.compile(pattern, flags).match(self)
+    
+    @wrapped
+    def fullmatch(self, pattern, flags=0):
+        return regex_cache.compile(pattern, flags).fullmatch(self)
+    
+    @wrapped
+    def split(self, pattern, maxsplit=0, flags=0):
+        return regex_cache.compile(pattern, flags).split(self, maxsplit)
+    
+    @wrapped
+    def findall(self, pattern, flags=0):
+        return regex_cache.compile(pattern, flags).findall(self)
+    
+    # REFACT consider ifind and find in the spirit of the collection methods?
+    @wrapped
+    def finditer(self, pattern, flags=0):
+        return regex_cache.compile(pattern, flags).finditer(self)
+    
+    @wrapped
+    def sub(self, pattern, replacement, count=0, flags=0):
+        return regex_cache.compile(pattern, flags).sub(replacement, self, count)
+    
+    @wrapped
+    def subn(self, pattern, replacement, count=0, flags=0):
+        return regex_cache.compile(pattern, flags).subn(replacement, self, count)
+
+def _separator_positions(data, view, separator):
+    find = getattr(data, 'find', None)
+    if find is None: # memoryviews can't search, but regular expressions can search them
+        import re
+        for match in regex_cache.compile(re.escape(bytes(separator))).finditer(view):
+            yield match.start()
+        return
+    
+    position = find(separator)
+    while position != -1:
+        yield position
+        position = find(separator, position + len(separator))
+
+def _split_records(data, separator, keepends):
+    "Memoryview slices of data between separators, found without copying data"
+    assert len(separator) > 0, 'Need a separator to split records'
+    view = memoryview(data)
+    if view.ndim != 1 or view.format != 'B':
+        view = view.cast('B')
+    
+    start = 0
+    for end in _separator_positions(data, view, separator):
+        yield view[start:end + len(separator) if keepends else end]
+        start = end + len(separator)
+    if start < len(view):
+        yield view[start:]
+
+@protected
+class Bytes(Iterable):
+    """Regex methods and zero copy record splitting for bytes, bytearray, memoryview and mmap.
+    
+    The regex methods work just like they do on `Text`, but with bytes patterns. 
+    Lines and records are returned as memoryview slices of the original data, so nothing is copied. 
+    Together with `mmap()` this allows to scan huge files without reading them into memory.
+    
+    >>> _.mmap('huge.log').ilines().igrep(rb'ERROR').map(bytes)
+    
+    Use `bytes(view)` or `str(view, 'utf8')` on the elements when you need a copy, but keep in 
+    mind that the copies stay valid after the mapped file is closed, while memoryviews do not.
+    """
+    
+    # Regex Methods ......................................
+    
+    search = Text.search
+    match = Text.match
+    fullmatch = Text.fullmatch
+    split = Text.split
+    findall = Text.findall
+    finditer = Text.finditer
+    sub = Text.sub
+    subn = Text.subn
+    
+    # Records ............................................
+    
+    @wrapped
+    def irecords(self, separator, keepends=False):
+        "Split at `separator` into memoryview slices. A trailing separator does not start an empty record."
+        return _split_records(self, separator, keepends)
+    records = tupleize(irecords)
+    
+    def ilines(self, keepends=False):
+        "Split at newlines into memoryview slices"
+        return self.irecords(b'\n', keepends)
+    lines = tupleize(ilines)
+    
+    @wrapped
+    def iblocks(self, size):
+        "Memoryview slices of `size` bytes, the last one may be shorter"
+        view = memoryview(self).cast('B')
+        return (view[start:start + size] for start in range(0, len(view), size))
+    blocks = tupleize(iblocks)
+
+@protected
+def mmap(path):
+    """Memory map the file at `path` for reading, wrapped as `Bytes`.
+    
+    The operating system pages the file in as needed, so even files much bigger 
+    than the available memory can be searched and split.
+    
+    >>> _.mmap('huge.log').finditer(rb'user=([a-z]+)').map(_.each.call.group(1))
+    """
+    import mmap as mmap_module
+    if _wrapper_class_for(mmap_module.mmap) is not Bytes:
+        register(mmap_module.mmap, Bytes)
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return wrap(b'') # empty files can't be mapped
+        return wrap(mmap_module.mmap(file.fileno(), 0, access=mmap_module.ACCESS_READ))
+
+_wrapper_types.extend((
+    (types.ModuleType, Module),
+    (str, Text),
+    ((bytes, bytearray, memoryview), Bytes),
+    (collections.abc.Mapping, Mapping),
+    (collections.abc.Set, Set),
+    (collections.abc.AsyncIterable, AsyncIterable),
+    (Replay, Replayable),
+    (collections.abc.Iterable, Iterable),
+    (collections.abc.Callable, Callable),
+))
+
+def _each_getattr(obj, name):
+    "Attribute access for each expressions. Items of mappings come first, just like with wrapped mappings."
+    if issubclass(_wrapper_class_for(type(obj)), Mapping) and name in obj:
+        return obj[name]
+    return getattr(obj, name)
+
+def _each_item_or_attribute(obj, name):
+    "`_each_getattr()` for types that are known to be mappings"
+    if name in obj:
+        return obj[name]
+    return getattr(obj, name)
+
+def _each_items_or_attributes(getter, names, obj):
+    "Several names of a mapping at once, with one `itemgetter` call if they are all items"
+    try:
+        return getter(obj)
+    except KeyError:
+        return tuple(_each_item_or_attribute(obj, name) for name in names)
+
+def _each_path(obj, path):
+    for name in path.split('.'):
+        obj = _each_getattr(obj, name)
+    return obj
+
+def _is_each_mapping(a_type):
+    return issubclass(_wrapper_class_for(a_type), Mapping)
+
+_MAXIMUM_EACH_ACCESSOR_TYPES = 64 # per accessor, don't keep too many dynamically created classes alive
+
+class _EachAccessor(object):
+    """Attribute access in each expressions, that selects the fastest way to get at the attribute once per type.
+    
+    That is `operator.attrgetter`, except for mappings where items come first, see `_each_getattr()`.
+    """
+    
+    __slots__ = ('names', 'accessors')
+    
+    def __init__(self, names):
+        self.names = names
+        self.accessors = {} # type -> accessor function
+    
+    def __call__(self, obj):
+        return self.accessors.get(type(obj), self.resolve)(obj)
+    
+    def resolve(self, obj):
+        accessor = self.accessor_for(type(obj))
+        if len(self.accessors) >= _MAXIMUM_EACH_ACCESSOR_TYPES:
+            self.accessors.clear()
+        self.accessors[type(obj)] = accessor
+        return accessor(obj)
+
+class _EachAttribute(_EachAccessor):
+
+    def accessor_for(self, a_type):
+        name, = self.names
+        if _is_each_mapping(a_type):
+            return functools.partial(_each_item_or_attribute, name=name)
+        return operator.attrgetter(name)
+
+class _EachPick(_EachAccessor):
+    "Several (dotted) attributes at once as a tuple, see `EachExpression.pick()`"
+    
+    __slots__ = ()
+    
+    def accessor_for(self, a_type):
+        # dotted paths can lead to mappings, where each.pick() has to use items
+        if len(self.names) > 1 and not any('.' in name for name in self.names):
+            if not _is_each_mapping(a_type):
+                return operator.attrgetter(*self.names)
+            # itemgetter would add missing keys to mappings with __missing__, like defaultdict
+            if not hasattr(a_type, '__missing__'):
+                return functools.partial(_each_items_or_attributes, operator.itemgetter(*self.names), self.names)
+        return lambda obj: tuple(_each_path(obj, name) for name in self.names)
+
+def _each_node(value):
+    "Expression tree node for an operand of an each expression"
+    if isinstance(value, EachExpression):
+        return value._EachExpression__tree
+    if isinstance(value, Each):
+        return ('element',)
+    return ('constant', value)
+
+def _render_each(node, constant, readable=False):
+    """Python source for an expression tree.
+    
+    `constant` is called with every constant value in the tree and returns the source to reference it.
+    The readable version is only meant for humans.
+    """
+    kind = node[0]
+    if kind == 'element':
+        return 'each'
+    if kind == 'constant':
+        source = constant(node[1])
+        if source.startswith('-'): # negative numbers bind weaker than ** and attribute access
+            return '(%s)' % source
+        return source
+    if kind == 'binary':
+        return '(%s %s %s)' % (_render_each(node[2], constant, readable), node[1], _render_each(node[3], constant, readable))
+    if kind == 'unary':
+        return '(%s%s)' % (node[1], _render_each(node[2], constant, readable))
+    if kind == 'function':
+        return '%s(%s)' % (
+            node[1].__name__ if readable else constant(node[1]),
+            ', '.join(_render_each(argument, constant, readable) for argument in node[2]))
+    if kind == 'getattr':
+        if readable:
+            return '%s.%s' % (_render_each(node[1], constant, readable), node[2])
+        return _render_each_accessor(_EachAttribute((node[2],)), node[1], constant)
+    if kind == 'pick':
+        if readable:
+            return '%s.pick(%s)' % (_render_each(node[1], constant, readable), ', '.join(map(repr, node[2])))
+        return _render_each_accessor(_EachPick(node[2]), node[1], constant)
+    if kind == 'getitems':
+        if readable:
+            return '%s[%s]' % (_render_each(node[1], constant, readable), ', '.join(map(repr, node[2])))
+        return '%s(%s)' % (constant(operator.itemgetter(*node[2])), _render_each(node[1], constant))
+    if kind == 'getitem':
+        return '%s[%s]' % (_render_each(node[1], constant, readable), _render_each(node[2], constant, readable))
+    if kind == 'methodcall':
+        _ignored, target, name, args, kwargs = node
+        import keyword
+        method = '.%s' % name
+        if not name.isidentifier() or keyword.iskeyword(name):
+            method = '.__getattribute__(%r)' % (name,)
+        arguments = [constant(argument) for argument in args]
+        for key, value in kwargs.items():
+            if key.isidentifier() and not keyword.iskeyword(key):
+                arguments.append('%s=%s' % (key, constant(value)))
+            else:
+                arguments.append('**{%r: %s}' % (key, constant(value)))
+        return '%s%s(%s)' % (_render_each(target, constant, readable), method, ', '.join(arguments))
+    raise ValueError('Unknown each expression node %r' % (node,))
+
+def _render_each_accessor(accessor, target, constant):
+    if target == ('element',): # inline the lookup of the accessor for the type of each, saves a python call
+        return '%s.get(type(each), %s)(each)' % (constant(accessor.accessors), constant(accessor.resolve))
+    return '%s(%s)' % (constant(accessor), _render_each(target, constant))
+
+def _compile_each(tree):
+    """Compile an expression tree into a single python function
+    
+    Simple constants are inlined, everything else is accessed as a closure variable, which is as fast as it gets.
+    """
+    names, values = ['_each_getattr'], [_each_getattr]
+    def constant(value):
+        if type(value) in (int, str, bytes, bool, type(None)) \
+                or type(value) is float and value not in (math.inf, -math.inf) and value == value:
+            return repr(value)
+        names.append('_%i' % len(names))
+        values.append(value)
+        return names[-1]
+    body = _render_each(tree, constant)
+    source = 'def closure(%s):\n    return lambda each: %s' % (', '.join(names), body)
+    namespace = dict()
+    exec(source, namespace)
+    function = namespace['closure'](*values)
+    function.__name__ = function.__qualname__ = 'each_expression'
+    function._each_tree = tree
+    return function
+
+_each_binary_operators = dict(
+    add='+', sub='-', mul='*', matmul='@', truediv='/', floordiv='//', mod='%', pow='**',
+    lshift='<<', rshift='>>', and_='&', or_='|', xor='^',
+)
+_each_comparison_operators = dict(lt='<', le='<=', eq='==', ne='!=', gt='>', ge='>=')
+_each_unary_operators = dict(neg='-', pos='+', invert='~', inv='~')
+# These have no syntax, but where always available on each
+_each_function_operators = (
+    'abs', 'concat', 'contains', 'not_', 'index', 'setitem', 'delitem',
+    'iadd', 'iand', 'iconcat', 'ifloordiv', 'ilshift', 'imatmul', 'imod', 'imul',
+    'ior', 'ipow', 'irshift', 'isub', 'itruediv', 'ixor',
+)
+
+def _dunder(name):
+    return '__%s__' % name.rstrip('_')
+
+def _make_binary_operator(symbol, reflected=False):
+    def operator_method(self, other):
+        if reflected:
+            return EachExpression(('binary', symbol, _each_node(other), _each_node(self)))
+        return EachExpression(('binary', symbol, _each_node(self), _each_node(other)))
+    return operator_method
+
+def _make_unary_operator(symbol):
+    return lambda self: EachExpression(('unary', symbol, _each_node(self)))
+
+def _make_function_operator(function):
+    def operator_method(self, *others):
+        return EachExpression(('function', function, (_each_node(self),) + tuple(map(_each_node, others))))
+    return functools.wraps(function)(operator_method)
+
+@protected
+class EachExpression(object):
+    """Function built from an expression on `each`.
+    
+    Everything you do to an each expression (operators, attribute access, item access and 
+    method calls via `.call`) is recorded in an expression tree. On the first call the tree 
+    is compiled into a single python function, so `_.each.price * _.each.quantity + 1` 
+    costs about as much as the equivalent hand written lambda.
+    
+    Wrapped methods like `Iterable.map()` call the compiled function directly.
+    """
+    
+    __slots__ = ('__tree', '__function')
+    
+    def __init__(self, tree):
+        self.__tree = tree
+        self.__function = None
+    
+    def __repr__(self):
+        return 'fluentpy.each expression: %s' % _render_each(self.__tree, repr, readable=True)
+    
+    def __call__(self, element):
+        return self._function(element)
+    
+    def __reduce__(self):
+        return EachExpression, (self.__tree,)
+    
+    @property
+    def _function(self):
+        "The compiled function"
+        if self.__function is None:
+            self.__function = _compile_each(self.__tree)
+        return self.__function
+    
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            # Don't pretend to implement protocols like __length_hint__ or __iter__
+            raise AttributeError(name)
+        return EachExpression(('getattr', self.__tree, name))
+    
+    def __getitem__(self, key):
+        if type(key) is tuple and len(key) > 1 and all(type(name) is str for name in key):
+            return EachExpression(('getitems', self.__tree, key))
+        return EachExpression(('getitem', self.__tree, _each_node(key)))
+    
+    __hash__ = object.__hash__
+    
+    for name, symbol in _each_binary_operators.items():
+        locals()[_dunder(name)] = _make_binary_operator(symbol)
+        locals()[_dunder('r' + name)] = _make_binary_operator(symbol, reflected=True)
+    for name, symbol in _each_comparison_operators.items():
+        locals()[_dunder(name)] = _make_binary_operator(symbol)
+    for name, symbol in _each_unary_operators.items():
+        locals()[_dunder(name)] = _make_unary_operator(symbol)
+    for name in _each_function_operators:
+        locals()[_dunder(name)] = _make_function_operator(getattr(operator, name, None) or getattr(builtins, name))
+    del name, symbol # prevent promotion to class variable
     
     @property
     def call(self):
-        class MethodCallerConstructor(object):
-            
-            _method_name = None
-            
-            def __getattr__(self, method_name):
-                self._method_name = method_name
-                return self
-            
-            def __call__(self, *args, **kwargs):
-                assert self._method_name is not None, \
-                    'Need to access the method to call first! E.g. _.each.call.method_name(arg1, kwarg="arg2")'
-                return operator.methodcaller(self._method_name, *args, **kwargs)
+        return MethodCallerConstructor(self.__tree)
+    
+    def pick(self, *names):
+        """Tuple of several attributes, for mappings items, with a single call to `operator.attrgetter` 
+        or `operator.itemgetter` where possible. Names can be dotted paths, which take the slow path.
         
-        return MethodCallerConstructor()
+        >>> _(users).map(_.each.pick('name', 'address.city'))
+        """
+        return EachExpression(('pick', self.__tree, names))
+
+class MethodCallerConstructor(object):
+    """Records the method name for `each.call.method_name(arg1, kwarg="arg2")`."""
+    
+    _method_name = None
+    
+    def __init__(self, tree):
+        self._tree = tree
+    
+    def __getattr__(self, method_name):
+        self._method_name = method_name
+        return self
+    
+    def __call__(self, *args, **kwargs):
+        assert self._method_name is not None, \
+            'Need to access the method to call first! E.g. _.each.call.method_name(arg1, kwarg="arg2")'
+        return EachExpression(('methodcall', self._tree, self._method_name, args, kwargs))
+
+_each_element = EachExpression(('element',))
+
+def _delegate_to_each_element(name):
+    return lambda self, *args: getattr(_each_element, name)(*args)
+
+class Each(Wrapper):
+    """Create functions from expressions.
+    
+    Use ``each.foo`` for attribute access, ``each['foo']`` for item access, ``each['foo', 'bar']`` or
+    ``each.pick('foo', 'bar.baz')`` to get several items or attributes as a tuple,
+    ``each.call.foo()`` to call methods or ``each == 'foo'`` (with pretty much any operator) to create callable operators.
+    
+    These can be combined as needed, e.g. ``(_.each.price * _.each.quantity + 1)``, see `EachExpression`.
+    Arguments given to methods via ``each.call`` are passed as is.
+    
+    Note: All generated functions never wrap their arguments or return values.
+    """
+    
+    for name, value in vars(EachExpression).items():
+        if name.startswith('__') and callable(value) and name not in ('__init__', '__repr__', '__getattr__', '__reduce__'):
+            locals()[name] = _delegate_to_each_element(name)
+    del name, value # prevent promotion to class variable
+    
+    __hash__ = object.__hash__
+    
+    def __getattr__(self, name):
+        return getattr(_each_element, name)
+    
+    def __getitem__(self, key):
+        return _each_element[key]
+    
+    @property
+    def call(self):
+        return _each_element.call
+    
+    def pick(self, *names):
+        return _each_element.pick(*names)
+    
+    def __reduce__(self):
+        return 'each'
 
 each_marker = "lambda generator"
 each = Each(each_marker, previous=None, chain=None)
@@ -687,13 +3236,68 @@ for index in range(NUMBER_OF_NAMED_ARGUMENT_PLACEHOLDERS):
     public(wrap(index), '_%i' % index)
 public(wrap('*'), '_args')
 
+_CLI_USAGE = """Usage:
+    python -m fluentpy 'code'           Run code that can access fluent functions without having to import them
+    python -m fluentpy -n 'code'        Run code for every line of stdin, the line (without newline) is in `line`
+    python -m fluentpy -p 'expression'  Print the result of expression for every line of stdin, unless it is None
+"""
+_CLI_BUFFER_SIZE = 2**20
+_CLI_BATCH_SIZE = 1024
+
+def _main(argv):
+    """Run `python -m fluentpy`.
+    
+    In the line modes the code is compiled once and stdin is read (and stdout written) 
+    in large blocks, so memory use stays constant and throughput is close to a hand written loop.
+    """
+    if len(argv) == 2 and argv[1] not in ('-n', '-p'):
+        exec(compile(argv[1], '<fluentpy>', 'exec'), vars(wrap))
+        return
+    if len(argv) != 3 or argv[1] not in ('-n', '-p'):
+        sys.exit(_CLI_USAGE)
+    
+    mode, source = argv[1:]
+    namespace = vars(wrap)
+    code = compile(source, '<fluentpy %s>' % mode, 'eval' if mode == '-p' else 'exec')
+    input_encoding = sys.stdin.encoding or 'utf-8'
+    lines = open(sys.stdin.fileno(), 'rb', buffering=_CLI_BUFFER_SIZE, closefd=False)
+    
+    if mode == '-n':
+        for line in lines:
+            namespace['line'] = line.decode(input_encoding, 'surrogateescape').rstrip('\n')
+            exec(code, namespace)
+        return
+    
+    sys.stdout.flush()
+    output_encoding = sys.stdout.encoding or 'utf-8'
+    output = open(sys.stdout.fileno(), 'wb', buffering=_CLI_BUFFER_SIZE, closefd=False)
+    batch = []
+    def write_batch():
+        batch.append('')
+        output.write('\n'.join(batch).encode(output_encoding, 'surrogateescape'))
+        batch.clear()
+    try:
+        for line in lines:
+            namespace['line'] = line.decode(input_encoding, 'surrogateescape').rstrip('\n')
+            result = eval(code, namespace)
+            if result is None:
+                continue
+            if isinstance(result, Wrapper):
+                result = result.unwrap
+            batch.append(result if type(result) is str else str(result))
+            if len(batch) >= _CLI_BATCH_SIZE:
+                write_batch()
+        write_batch()
+        output.flush()
+    except BrokenPipeError:
+        # Stop without a traceback if the reader went away (e.g. `| head`), but report it like python does
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+
 # Make the module executable via `python -m fluentpy "some fluent using python code"`
 if __name__ == '__main__':
-    assert len(sys.argv) == 2, \
-        "Usage: python -m fluentpy 'some code that can access fluent functions without having to import them'"
-    
     # __wrapper_is_sealed = True
-    exec(sys.argv[1], vars(wrap))
+    _main(sys.argv)
 else:
     @functools.wraps(wrap)
     def executable_module(*args, **kwargs): return wrap(*args, **kwargs)